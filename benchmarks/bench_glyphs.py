@@ -0,0 +1,117 @@
+import argparse
+import os
+from unittest import mock
+
+from synthetic import add_network_arguments, get_network, load_map_data, measure, run_main
+
+import draw_elements
+import reference
+from draw_elements import GlyphCache, Orientation, glyph_cache, strip_cache
+from raster_backend import get_pixel_difference
+from utilities import clear_asset_caches
+
+GLYPHS = {
+    "end station": (
+        draw_elements.get_end_station,
+        reference.get_end_station,
+        [(orientation,) for orientation in Orientation if orientation.value < 360],
+    ),
+    "station": (
+        draw_elements.get_station,
+        reference.get_station,
+        [(orientation,) for orientation in Orientation if orientation.value < 360],
+    ),
+    "transfer": (
+        draw_elements.get_transfer,
+        reference.get_transfer,
+        [("metro", orientation) for orientation in Orientation],
+    ),
+}
+
+
+def compare_glyphs(map_data, repeat):
+    line_images = {id(line.line_image): line.line_image for line in map_data.lines}
+    print(f"{'glyph':<12} {'per pixel':>10} {'numpy':>10} {'speedup':>8} {'max diff':>9}")
+    for name, (function, reference_function, arguments) in GLYPHS.items():
+        # the uncached glyph functions, every call builds the glyph
+        function = function.__wrapped__
+        old_time = new_time = max_difference = 0
+        for line_image in line_images.values():
+            for args in arguments:
+                old_time += measure(lambda: reference_function(line_image, *args).close(), repeat)
+                new_time += measure(lambda: function(line_image, *args).close(), repeat)
+                with reference_function(line_image, *args) as old_glyph, function(
+                        line_image, *args
+                ) as glyph:
+                    max_difference = max(
+                        max_difference, get_pixel_difference(old_glyph, glyph)[0]
+                    )
+        print(
+            f"{name:<12} {old_time * 1000:8.1f}ms {new_time * 1000:8.1f}ms "
+            f"{old_time / new_time:7.1f}x {max_difference:9.6f}"
+        )
+
+
+def run_linear(map_data_path, assets_path, output):
+    # every run starts without decoded assets, texts or glyphs, and no
+    # --cache-dir is given so nothing comes from the disk cache either
+    clear_asset_caches()
+    glyph_cache.clear()
+    strip_cache.clear()
+    run_main("linear", map_data_path, assets_path, "--all", "--force", "--jobs", "1", "-o", output)
+
+
+def run_linear_per_pixel(map_data_path, assets_path, output):
+    # the old loops behind a cache of their own, so both runs build every
+    # glyph once and only the way glyphs are built differs
+    reference_cache = GlyphCache(persistent=False)
+    patches = [
+        mock.patch(
+            f"map_data.{name}",
+            lambda line, *args, reference_function=getattr(reference, name): reference_cache.get(
+                reference_function, line, *args
+            ),
+        )
+        for name in ["get_end_station", "get_station", "get_transfer"]
+    ]
+    for patch in patches:
+        patch.start()
+    try:
+        run_linear(map_data_path, assets_path, output)
+    finally:
+        for patch in patches:
+            patch.stop()
+
+
+def compare_linear(map_data_path, assets_path, work_dir, repeat):
+    runs = [
+        (run_linear, os.path.join(work_dir, "linear")),
+        (run_linear_per_pixel, os.path.join(work_dir, "linear_old")),
+    ]
+    times = {run: [] for run, _ in runs}
+    for num in range(repeat):
+        # the order alternates so neither variant always runs on a warmer machine
+        for run, output in runs if num % 2 == 0 else runs[::-1]:
+            times[run].append(measure(lambda: run(map_data_path, assets_path, output), 1))
+
+    old_time = min(times[run_linear_per_pixel])
+    new_time = min(times[run_linear])
+    print(
+        f"linear --all: per pixel {old_time:.2f}s, numpy {new_time:.2f}s "
+        f"({old_time / new_time:.1f}x)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time building line glyphs and rendering all linear maps")
+    add_network_arguments(parser, 7, 30)
+    parser.add_argument("--repeat", default=3, type=int, help="runs per measurement")
+    args = parser.parse_args()
+
+    map_data_path, assets_path = get_network(args)
+    compare_glyphs(load_map_data(map_data_path, assets_path), args.repeat)
+    compare_linear(map_data_path, assets_path, args.work_dir, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+
+from synthetic import find_font, get_map_json, measure, write_assets
+
+from map_data import MapData
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time building and drawing growing synthetic networks")
+    parser.add_argument("--lines", default=10, type=int, help="lines of every network")
+    parser.add_argument(
+        "--stations",
+        action="extend",
+        nargs="+",
+        default=[],
+        type=int,
+        help="total stations of the networks, 625 to 5000 by default",
+    )
+    parser.add_argument("--repeat", default=3, type=int, help="runs per measurement")
+    parser.add_argument("--font", default=find_font(), help="TrueType font for the synthetic assets")
+    parser.add_argument("--work-dir", default="bench_work", help="folder for generated files")
+    args = parser.parse_args()
+    if args.font is None:
+        raise SystemExit("No font found, pass one with --font")
+
+    assets_path = os.path.join(args.work_dir, "assets")
+    write_assets(assets_path, args.font)
+
+    # every step should take about the same time per station when it is
+    # linear in the size of the network
+    print(f"{'stations':>8} {'build':>10} {'per station':>12} {'draw':>10} {'per station':>12}")
+    for stations_count in args.stations or [625, 1250, 2500, 5000]:
+        map_data_text = json.dumps(get_map_json(args.lines, stations_count // args.lines))
+
+        build_time = measure(lambda: MapData(json.loads(map_data_text), assets_path), args.repeat)
+
+        map_data = MapData(json.loads(map_data_text), assets_path)
+        # the glyphs are built once, the measured draws only place them
+        map_data.get_display_list()
+        draw_time = measure(map_data.get_display_list, args.repeat)
+
+        count = args.lines * (stations_count // args.lines)
+        print(
+            f"{count:>8} {build_time * 1000:8.1f}ms {build_time / count * 1e6:10.1f}us "
+            f"{draw_time * 1000:8.1f}ms {draw_time / count * 1e6:10.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
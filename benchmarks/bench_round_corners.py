@@ -0,0 +1,53 @@
+import argparse
+
+from synthetic import measure
+
+from wand.color import Color
+from wand.image import Image
+
+import reference
+import utilities
+from raster_backend import get_pixel_difference
+
+# the images round_corners gets on the sign and linear map paths
+CASES = [
+    ("sign content", 384 - 8, 128 - 8, Color("#FFFFFFFF"), 6),
+    ("sign frame", 384, 128, Color("#444450FF"), 10),
+    ("linear map", 1920, 128, Color("white"), 10),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time rounding the corners of signs and linear maps")
+    parser.add_argument("--repeat", default=20, type=int, help="runs per measurement")
+    args = parser.parse_args()
+
+    print(f"{'image':<14} {'size':>9} {'radius':>6} {'per pixel':>10} {'numpy':>9} {'speedup':>8} {'max diff':>9}")
+    for name, width, height, background, radius in CASES:
+        with Image(width=width, height=height, background=background) as image:
+            image.virtual_pixel = "transparent"
+
+            def time_round_corners(round_corners):
+                # the copies are made outside of the measured calls
+                copies = [image.clone() for _ in range(args.repeat)]
+                times = [measure(lambda: round_corners(copy, radius), 1) for copy in copies]
+                for copy in copies:
+                    copy.close()
+                return min(times)
+
+            old_time = time_round_corners(reference.round_corners)
+            new_time = time_round_corners(utilities.round_corners)
+
+            with image.clone() as old_image, image.clone() as new_image:
+                reference.round_corners(old_image, radius)
+                utilities.round_corners(new_image, radius)
+                max_difference, _ = get_pixel_difference(old_image, new_image)
+
+        print(
+            f"{name:<14} {width:>4}x{height:<4} {radius:>6} {old_time * 1000:8.2f}ms "
+            f"{new_time * 1000:7.2f}ms {old_time / new_time:7.1f}x {max_difference:9.6f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
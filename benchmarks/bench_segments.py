@@ -0,0 +1,77 @@
+import argparse
+
+from synthetic import add_network_arguments, get_network, load_map_data, measure
+
+from wand.color import Color
+from wand.image import Image
+
+from draw_elements import glyph_cache, strip_cache
+from map_data import Line, LineSegment, draw_options
+from raster_backend import get_pixel_difference
+from utilities import Direction, RelativeTo, move, opposite, place
+
+
+def continue_line_per_segment(coords, image, line_image, delta, direction):
+    # Line.continue_line before strips were shared and segments batched
+    if delta > 0:
+        line_part = line_image.clone()
+        line_part.resize(delta, line_part.height)
+        if direction in ["up", "down"]:
+            line_part.rotate(90)
+        place(image, line_part, coords, RelativeTo[opposite(direction.upper())])
+    return move(coords, delta, Direction[direction.upper()])
+
+
+def draw_lines(map_data):
+    image = Image(
+        width=map_data.image_resolution[1],
+        height=map_data.image_resolution[0],
+        background=Color("white"),
+    )
+    for line in map_data.lines:
+        line.draw(image)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time drawing the paths of all lines")
+    # 5 lines of 85 stations have 100 segments each, counting the detours
+    add_network_arguments(parser, 5, 85)
+    parser.add_argument("--repeat", default=3, type=int, help="runs per measurement")
+    args = parser.parse_args()
+
+    map_data = load_map_data(*get_network(args))
+    segments_count = sum(
+        isinstance(element, LineSegment) for line in map_data.lines for element in line.elements
+    )
+    print(f"{len(map_data.lines)} lines, {segments_count} segments")
+
+    continue_line = Line.continue_line
+    Line.continue_line = staticmethod(continue_line_per_segment)
+    try:
+        old_time = measure(lambda: draw_lines(map_data).close(), args.repeat)
+        old_image = draw_lines(map_data)
+    finally:
+        Line.continue_line = continue_line
+
+    print(f"{'drawing':<18} {'cold':>10} {'warm':>10} {'speedup':>8} {'max diff':>9} {'mean diff':>11}")
+    print(f"{'per segment':<18} {'':>10} {old_time * 1000:8.1f}ms")
+    with old_image:
+        for name, batch_segments in [("shared strips", False), ("batched rectangles", True)]:
+            draw_options["batch_segments"] = batch_segments
+            try:
+                glyph_cache.clear()
+                strip_cache.clear()
+                cold_time = measure(lambda: draw_lines(map_data).close(), 1)
+                warm_time = measure(lambda: draw_lines(map_data).close(), args.repeat)
+                with draw_lines(map_data) as image:
+                    max_difference, mean_difference = get_pixel_difference(old_image, image)
+            finally:
+                draw_options["batch_segments"] = False
+            print(
+                f"{name:<18} {cold_time * 1000:8.1f}ms {warm_time * 1000:8.1f}ms "
+                f"{old_time / warm_time:7.1f}x {max_difference:9.6f} {mean_difference:11.8f}"
+            )
+
+if __name__ == "__main__":
+    main()
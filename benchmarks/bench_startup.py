@@ -0,0 +1,43 @@
+import argparse
+import os
+import subprocess
+import sys
+
+from synthetic import add_network_arguments, get_network, load_map_data, measure
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+def run(*args):
+    subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a one-sign render against a full map render")
+    add_network_arguments(parser, 10, 50)
+    parser.add_argument("--repeat", default=3, type=int, help="runs per measurement")
+    args = parser.parse_args()
+
+    map_data_path, assets_path = get_network(args)
+    line = load_map_data(map_data_path, assets_path).lines[0]
+    station_name = next(iter(line.stations_by_name))
+    output = os.path.join(args.work_dir, "startup")
+
+    # every run is a new process, so nothing is decoded before it starts
+    commands = {
+        "import only": ["-c", f"import sys; sys.path.insert(0, {os.path.dirname(MAIN_PATH)!r}); import main"],
+        "one sign": [
+            MAIN_PATH, "station", map_data_path, assets_path,
+            "-l", line.name, "-s", station_name, "-o", output, "--force",
+        ],
+        "full map": [MAIN_PATH, "full", map_data_path, assets_path, "-o", os.path.join(output, "map.png")],
+    }
+    times = {name: measure(lambda: run(*command), args.repeat) for name, command in commands.items()}
+
+    for name, run_time in times.items():
+        print(f"{name:<12} {run_time * 1000:8.1f}ms")
+    print(f"one sign takes {times['one sign'] / times['full map']:.0%} of a full map render")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+
+from synthetic import add_network_arguments, get_network, load_map_data, measure
+
+from wand.color import Color
+from wand.image import Image
+
+import reference
+from raster_backend import get_pixel_difference
+from utilities import draw_shapes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time drawing transfer connectors per shape and in one pass")
+    add_network_arguments(parser, 20, 60, 5)
+    parser.add_argument("--repeat", default=3, type=int, help="runs per measurement")
+    args = parser.parse_args()
+
+    map_data = load_map_data(*get_network(args))
+    shapes = [shape for transfer in map_data.transfers for shape in transfer.get_shapes()]
+    direct_count = sum(transfer.is_direct for transfer in map_data.transfers)
+    print(
+        f"{len(map_data.transfers)} transfers ({direct_count} direct), {len(shapes)} shapes "
+        f"on a {map_data.image_resolution[1]}x{map_data.image_resolution[0]} map"
+    )
+
+    def get_image():
+        return Image(
+            width=map_data.image_resolution[1],
+            height=map_data.image_resolution[0],
+            background=Color("white"),
+        )
+
+    results = {}
+    for name, draw in [("per shape", reference.draw_shapes), ("one pass", draw_shapes)]:
+        images = [get_image() for _ in range(args.repeat)]
+        results[name] = min(measure(lambda: draw(image, shapes), 1) for image in images)
+        for image in images[1:]:
+            image.close()
+        results[name, "image"] = images[0]
+
+    with results["per shape", "image"] as old_image, results["one pass", "image"] as image:
+        max_difference, mean_difference = get_pixel_difference(old_image, image)
+
+    print(f"per shape: {results['per shape'] * 1000:8.1f} ms")
+    print(f"one pass:  {results['one pass'] * 1000:8.1f} ms ({results['per shape'] / results['one pass']:.1f}x)")
+    print(f"difference: max {max_difference:.6f}, mean {mean_difference:.8f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import time
+from unittest import mock
+
+from synthetic import add_network_arguments, get_network, run_main
+
+from draw_elements import glyph_cache
+from image_writer import ImageWriter, output_stats
+
+
+class SynchronousWriter(ImageWriter):
+    # encodes and writes on the render thread, like Image.save did
+    def submit(self, image, filenames, close=True):
+        self.slots.acquire()
+        self.write(image, filenames, close)
+
+
+def run_linear(map_data_path, assets_path, output, write_threads):
+    glyph_cache.clear()
+    output_stats.__init__()
+    start_time = time.perf_counter()
+    run_main(
+        "linear", map_data_path, assets_path, "--all", "--force", "--jobs", "1",
+        "--write-threads", str(write_threads), "-o", output,
+    )
+    return time.perf_counter() - start_time
+
+
+def report(name, wall_time):
+    write_time = output_stats.encode_time + output_stats.io_time
+    # the part of the encoding and writing that ran while rendering went on
+    hidden_time = output_stats.render_time + write_time - wall_time
+    print(
+        f"{name:<16} {wall_time:7.2f}s  render {output_stats.render_time:6.2f}s  "
+        f"encode {output_stats.encode_time:6.2f}s  I/O {output_stats.io_time:5.2f}s  "
+        f"wait {output_stats.wait_time:5.2f}s  overlap {max(hidden_time, 0) / write_time:4.0%}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time linear --all with and without the write-behind pool")
+    add_network_arguments(parser, 10, 50)
+    parser.add_argument(
+        "--write-threads",
+        action="extend",
+        nargs="+",
+        default=[],
+        type=int,
+        help="writer thread counts to try, 1 2 4 by default",
+    )
+    args = parser.parse_args()
+
+    map_data_path, assets_path = get_network(args)
+    output = os.path.join(args.work_dir, "linear")
+
+    with mock.patch("render_jobs.create_writer", lambda: SynchronousWriter()):
+        report("synchronous", run_linear(map_data_path, assets_path, output, 1))
+    for write_threads in args.write_threads or [1, 2, 4]:
+        report(
+            f"{write_threads} write threads",
+            run_linear(map_data_path, assets_path, output, write_threads),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# The per-pixel loops and per-shape drawing the current code replaced, kept
+# as they were so the benchmarks can time and check the current code against them
+from wand.color import Color
+from wand.drawing import Drawing
+from wand.image import Image
+
+from draw_elements import Orientation
+
+
+def get_end_station(line, orientation):
+    end_station = Image(width=line.height, height=3 * line.height)
+    end_station.virtual_pixel = 'transparent'
+
+    for x in range(end_station.width):
+        for y in range(end_station.height):
+            if y <= line.height // 2:
+                dist = min(y, x, line.height - 1 - x)
+            elif y >= end_station.height - 1 - line.height // 2:
+                dist = min(end_station.height - 1 - y, x, line.height - 1 - x)
+            else:
+                if x >= line.height // 2:
+                    dist = line.height - 1 - x
+                else:
+                    dist = line.height // 2 - min(line.height // 2 - x, abs(y - end_station.height // 2))
+
+            end_station[x, y] = line[0, dist]
+
+    end_station.rotate(orientation.value)
+
+    return end_station
+
+
+def get_station(line, orientation):
+    station = Image(width=2 * line.height, height=line.height)
+    station.virtual_pixel = 'transparent'
+
+    for x in range(station.width):
+        for y in range(station.height):
+            if x <= line.height // 2:
+                dist = line.height // 2 - abs(station.height // 2 - x)
+            elif x < line.height:
+                dist = line.height // 2 - min(x - station.height // 2, abs(y - station.height // 2))
+            else:
+                dist = min(y, line.height - 1 - y, station.width - 1 - x)
+
+            station[x, y] = line[0, dist]
+
+    station.rotate(orientation.value)
+
+    return station
+
+
+def get_transfer(line, line_type, orientation):
+    transfer = line.clone()
+    transfer.virtual_pixel = 'transparent'
+    if line_type == 'metro':
+        transfer.resize(64, transfer.height)
+        transfer.distort('arc', (360, 0))
+        transfer.resize(27, 27)
+    if line_type == 'mcd':
+        transfer.resize(44, transfer.height + 1)
+        transfer.distort('arc', (360, 0))
+        transfer.resize(29, 29)
+
+    base = Image(width=transfer.width, height=transfer.height)
+    for x in range(base.width):
+        for y in range(base.height):
+            if (x - base.width // 2) ** 2 + (y - base.height // 2) ** 2 <= 9 ** 2:
+                base[x, y] = Color('#FFFFFF')
+
+    base.composite(transfer)
+
+    line_part = line.clone()
+    line_part.resize(width=3)
+    line_part_base = Image(width=6, height=line.height)
+    line_part_base.virtual_pixel = 'transparent'
+    line_part_base.composite(line_part)
+
+    for i in range(line_part_base.height):
+        if 3 <= i < 6:
+            line_part_base[3, i] = line[0, i]
+            line_part_base[4, i] = line[0, i]
+            line_part_base[5, i] = line[0, i]
+
+    if orientation.name in [Orientation.HORIZONTAL.name, Orientation.VERTICAL.name]:
+        base.composite(line_part_base, top=(base.height - line.height) // 2)
+    line_part_base.flop()
+    base.composite(line_part_base, left=base.width - line_part_base.width, top=(base.height - line.height) // 2)
+
+    base.rotate(orientation.value)
+
+    return base
+
+
+def round_corner(image, radius, coords, positive_dx, positive_dy):
+    for x in (
+            range(coords[0], coords[0] + radius + 1)
+            if positive_dx
+            else range(coords[0] - radius, coords[0] + 1)
+    ):
+        for y in (
+                range(coords[1], coords[1] + radius + 1)
+                if positive_dy
+                else range(coords[1] - radius, coords[1] + 1)
+        ):
+            if (x - coords[0]) ** 2 + (y - coords[1]) ** 2 > radius ** 2:
+                image[x, y] = Color("#FFFFFF00")
+
+
+def round_corners(image, radius):
+    round_corner(image, radius, (radius, radius), False, False)
+    round_corner(image, radius, (image.width - 1 - radius, radius), True, False)
+    round_corner(image, radius, (radius, image.height - 1 - radius), False, True)
+    round_corner(
+        image, radius, (image.width - 1 - radius, image.height - 1 - radius), True, True
+    )
+
+
+def draw_shapes(image, shapes):
+    # every transfer dot and connector line in a drawing pass of its own
+    for shape in shapes:
+        with Drawing() as draw:
+            draw.stroke_color = shape.color
+            if shape.stroke_width is not None:
+                draw.stroke_width = shape.stroke_width
+            if shape.kind == "circle":
+                draw.fill_color = shape.color
+                draw.circle(*shape.points)
+            else:
+                draw.line(*shape.points)
+            draw(image)
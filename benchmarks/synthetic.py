@@ -0,0 +1,206 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LINE_COLORS = ["#D6083B", "#0078BE", "#009A49", "#EA7125", "#943E90", "#FFCD1C", "#8D5B2D"]
+
+
+def get_line_json(num, stations_count, segment_length, turn_every, textured):
+    elements = []
+    turn_down = True
+    for station_num in range(stations_count):
+        if station_num:
+            if turn_every and station_num % turn_every == 0:
+                # a detour keeps the line within its band of the map
+                elements.append({"type": "line_segment", "length": segment_length})
+                elements.append({"type": "turn", "direction": "down" if turn_down else "up"})
+                elements.append({"type": "line_segment", "length": segment_length})
+                elements.append({"type": "turn", "direction": "right"})
+                turn_down = not turn_down
+            elements.append({"type": "line_segment", "length": segment_length})
+        elements.append(
+            {
+                "type": "station",
+                "name": f"Station {num}-{station_num}",
+                "name_offset": [0, -20] if station_num % 2 else [0, 20],
+                "name_relative_to": "down" if station_num % 2 else "up",
+                "orientation": "up" if station_num % 2 else "down",
+            }
+        )
+
+    line_json = {
+        "name": f"Line {num}",
+        "type": "metro",
+        "priority": num,
+        "start": [100, 150 + num * 150],
+        "direction": "right",
+        "start_logo_offset": [-40, 0],
+        "end_logo_offset": [40, 0],
+        "logo_filename": f"logo_{num % len(LINE_COLORS)}.png",
+        "elements": elements,
+    }
+    if textured:
+        line_json["line_filename"] = f"line_{num % len(LINE_COLORS)}.png"
+    else:
+        line_json["line_color"] = LINE_COLORS[num % len(LINE_COLORS)]
+    return line_json
+
+
+def get_map_json(
+        lines_count, stations_count, segment_length=80, turn_every=10, transfer_every=10, textured=False
+):
+    # lines run left to right in bands of 150 pixels, every few stations one
+    # is linked to the same station of the next line, every other link is direct
+    lines = [
+        get_line_json(num, stations_count, segment_length, turn_every, textured)
+        for num in range(lines_count)
+    ]
+    turns_count = (stations_count - 1) // turn_every if turn_every else 0
+    width = 300 + segment_length * (stations_count - 1 + 2 * turns_count)
+    height = 300 + lines_count * 150
+
+    transfers = []
+    for num in range(lines_count - 1):
+        for station_num in range(transfer_every // 2, stations_count - 1, transfer_every):
+            transfers.append(
+                {
+                    "station1": {
+                        "line_name": f"Line {num}",
+                        "station_name": f"Station {num}-{station_num}",
+                    },
+                    "station2": {
+                        "line_name": f"Line {num + 1}",
+                        "station_name": f"Station {num + 1}-{station_num}",
+                    },
+                    "is_direct": station_num // transfer_every % 2 == 1,
+                }
+            )
+
+    return {
+        "image_resolution": [height, width],
+        "font_filename": "font.ttf",
+        "info_filename": "info.png",
+        "no_boarding_filename": "no_boarding.png",
+        "lines": lines,
+        "transfers": transfers,
+    }
+
+
+def find_font():
+    for pattern in ["/usr/share/fonts/**/*.ttf", "/usr/local/share/fonts/**/*.ttf"]:
+        fonts = sorted(glob.glob(pattern, recursive=True))
+        if fonts:
+            return fonts[0]
+    return None
+
+
+def write_assets(assets_path, font_path):
+    import numpy
+    from wand.color import Color
+    from wand.drawing import Drawing
+    from wand.image import Image
+
+    os.makedirs(os.path.join(assets_path, "images"), exist_ok=True)
+    os.makedirs(os.path.join(assets_path, "fonts"), exist_ok=True)
+    shutil.copyfile(font_path, os.path.join(assets_path, "fonts", "font.ttf"))
+
+    for num, color in enumerate(LINE_COLORS):
+        with Image(width=64, height=64, background=Color("transparent")) as logo:
+            with Drawing() as draw:
+                draw.fill_color = Color(color)
+                draw.circle((32, 32), (32, 2))
+                draw(logo)
+            logo.save(filename=os.path.join(assets_path, "images", f"logo_{num}.png"))
+
+        # a line with a lighter stripe in its middle, like the MCD lines
+        column = numpy.empty((9, 1, 4), dtype=numpy.uint8)
+        column[:] = [int(color[i: i + 2], 16) for i in (1, 3, 5)] + [255]
+        column[3:6] = 255
+        with Image.from_array(column, channel_map="RGBA") as line:
+            line.save(filename=os.path.join(assets_path, "images", f"line_{num}.png"))
+
+    with Image(width=300, height=150, background=Color("lightgray")) as info:
+        info.save(filename=os.path.join(assets_path, "images", "info.png"))
+    with Image(width=600, height=128, background=Color("gray")) as no_boarding:
+        no_boarding.save(filename=os.path.join(assets_path, "images", "no_boarding.png"))
+
+
+def write_network(path, lines_count, stations_count, font_path, textured=False, transfer_every=10):
+    assets_path = os.path.join(path, "assets")
+    write_assets(assets_path, font_path)
+    map_data_path = os.path.join(path, "map.json")
+    with open(map_data_path, "w", encoding="utf-8") as file:
+        json.dump(
+            get_map_json(
+                lines_count, stations_count, transfer_every=transfer_every, textured=textured
+            ),
+            file,
+        )
+    return map_data_path, assets_path
+
+
+def add_network_arguments(parser, lines_count, stations_count, transfer_every=10):
+    parser.add_argument(
+        "--map-data", default=None, help="map to measure instead of a synthetic network"
+    )
+    parser.add_argument("--assets", default=None, help="asset folder of --map-data")
+    parser.add_argument("--lines", default=lines_count, type=int, help="lines of the synthetic network")
+    parser.add_argument(
+        "--stations", default=stations_count, type=int, help="stations per line of the synthetic network"
+    )
+    parser.add_argument(
+        "--transfer-every", default=transfer_every, type=int, help="stations between transfers"
+    )
+    parser.add_argument("--textured", action="store_true", help="use line images with a stripe")
+    parser.add_argument("--font", default=find_font(), help="TrueType font for the synthetic assets")
+    parser.add_argument("--work-dir", default="bench_work", help="folder for generated files")
+
+
+def get_network(args):
+    if args.map_data is not None:
+        return args.map_data, args.assets
+    if args.font is None:
+        raise SystemExit("No font found, pass one with --font")
+    return write_network(
+        args.work_dir, args.lines, args.stations, args.font, args.textured, args.transfer_every
+    )
+
+
+def load_map_data(map_data_path, assets_path):
+    from map_data import MapData
+
+    with open(map_data_path, encoding="utf-8") as file:
+        return MapData(json.load(file), assets_path)
+
+
+def run_main(*args):
+    # runs a command of main.py in this process, so it can be patched
+    import main
+
+    with mock.patch.object(sys, "argv", ["main.py", *args]), open(os.devnull, "w") as devnull:
+        with mock.patch.object(sys, "stdout", devnull):
+            main.main()
+
+
+def measure(function, repeat=3):
+    # the best of a few runs, the others mostly measure the machine
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic metro network")
+    add_network_arguments(parser, 10, 50)
+    args = parser.parse_args()
+    print(*get_network(args))
@@ -1,8 +1,86 @@
 from wand.image import Image
-from wand.color import Color
 from enum import Enum
 
-from functools import lru_cache
+from collections import OrderedDict
+from functools import wraps
+import threading
+import weakref
+
+import numpy
+
+from raster_cache import get_cached_raster
+from utilities import ImageSize
+
+
+class GlyphCache:
+    def __init__(self, maxsize=256, persistent=True):
+        self.maxsize = maxsize
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self.glyphs = OrderedDict()
+        self.fingerprints = {}
+        self.lock = threading.Lock()
+
+    def get_fingerprint(self, image):
+        # source images are never modified once loaded, so the signature is
+        # computed once per image object instead of on every lookup
+        key = id(image)
+        fingerprint = self.fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = (image.width, image.height, image.signature)
+            self.fingerprints[key] = fingerprint
+            weakref.finalize(image, self.fingerprints.pop, key, None)
+        return fingerprint
+
+    def get(self, function, line, *args):
+        key = (function.__name__, self.get_fingerprint(line), *args)
+        with self.lock:
+            if key in self.glyphs:
+                self.glyphs.move_to_end(key)
+                self.hits += 1
+                return self.glyphs[key]
+            self.misses += 1
+
+        if self.persistent:
+            glyph = get_cached_raster(
+                (function.__name__, key[1], *args), lambda: function(line, *args)
+            )
+        else:
+            glyph = function(line, *args)
+        with self.lock:
+            self.glyphs[key] = glyph
+            while len(self.glyphs) > self.maxsize:
+                self.glyphs.popitem(last=False)
+        return glyph
+
+    def clear(self):
+        with self.lock:
+            self.glyphs.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+glyph_cache = GlyphCache()
+# straight strips are cheap to build but come in many lengths, they get
+# their own cache so they do not push the other glyphs out
+strip_cache = GlyphCache(maxsize=1024, persistent=False)
+
+
+def cached_glyph(get_size=None):
+    # given the size of a line image instead of the image, a glyph function
+    # with a size function only computes the size of its glyph, nothing is
+    # rasterized
+    def decorator(function):
+        @wraps(function)
+        def wrapper(line, *args):
+            if get_size is not None and isinstance(line, ImageSize):
+                return get_size(line, *args)
+            return glyph_cache.get(function, line, *args)
+
+        return wrapper
+
+    return decorator
 
 
 class Orientation(Enum):
@@ -14,14 +92,6 @@ class Orientation(Enum):
     VERTICAL = 450
 
 
-@lru_cache(maxsize=10)
-def get_line(line, length, orientation):
-    long_line = line.clone()
-    long_line.resize(width=length)
-    long_line.rotate(orientation.value)
-    return long_line
-
-
 class TurnType(Enum):
     RIGHT_DOWN = 0
     RIGHT_UP = 90
@@ -33,7 +103,13 @@ class TurnType(Enum):
     UP_LEFT = 0
 
 
-@lru_cache(maxsize=10)
+def rotate_size(size, degrees):
+    if degrees % 180 == 90:
+        return ImageSize(size.height, size.width)
+    return size
+
+
+@cached_glyph()
 def get_arc(line, turn):
     arc = line.clone()
     arc.virtual_pixel = 'transparent'
@@ -49,52 +125,128 @@ def get_arc(line, turn):
     return res_image
 
 
-@lru_cache(maxsize=10)
-def get_end_station(line, orientation):
-    end_station = Image(width=line.height, height=3 * line.height)
-    end_station.virtual_pixel = 'transparent'
-
-    for x in range(end_station.width):
-        for y in range(end_station.height):
-            if y <= line.height // 2:
-                dist = min(y, x, line.height - 1 - x)
-            elif y >= end_station.height - 1 - line.height // 2:
-                dist = min(end_station.height - 1 - y, x, line.height - 1 - x)
-            else:
-                if x >= line.height // 2:
-                    dist = line.height - 1 - x
-                else:
-                    dist = line.height // 2 - min(line.height // 2 - x, abs(y - end_station.height // 2))
-
-            end_station[x, y] = line[0, dist]
+def get_line_column(line):
+    return numpy.array(
+        line.export_pixels(0, 0, 1, line.height, "RGBA", "short"), dtype=numpy.uint16
+    ).reshape(line.height, 4)
+
+
+def get_line_pixel(line):
+    # the pixel of a line image that is one colour throughout, or None
+    pixels = numpy.array(
+        line.export_pixels(0, 0, line.width, line.height, "RGBA", "short"),
+        dtype=numpy.uint16,
+    ).reshape(-1, 4)
+    if (pixels == pixels[0]).all():
+        return pixels[0]
+    return None
+
+
+def get_line_color(line):
+    # the fill color of a line image of one opaque colour, or None
+    pixel = strip_cache.get(get_line_pixel, line)
+    if pixel is None or pixel[3] != numpy.iinfo(numpy.uint16).max:
+        return None
+    return line[0, 0]
+
+
+def get_line_strip(line, length, vertical):
+    pixel = strip_cache.get(get_line_pixel, line)
+    if pixel is None:
+        # resizing a patterned line image also filters across its rows,
+        # only ImageMagick gives the same pixels
+        strip = line.clone()
+        strip.resize(length, line.height)
+        if vertical:
+            strip.rotate(90)
+        return strip
+
+    # a line image of one colour stays that colour whatever the filter
+    size = get_strip_size(line, length, vertical)
+    pixels = numpy.empty((size.height, size.width, 4), dtype=numpy.uint16)
+    pixels[:] = pixel
+    return Image.from_array(pixels, channel_map="RGBA")
+
+
+def get_strip_size(line, length, vertical):
+    return rotate_size(ImageSize(length, line.height), 90 if vertical else 0)
 
+
+def get_glyph_image(line, dist):
+    glyph = Image.from_array(
+        numpy.ascontiguousarray(get_line_column(line)[dist]), channel_map="RGBA"
+    )
+    glyph.virtual_pixel = 'transparent'
+    return glyph
+
+
+def get_end_station_size(line, orientation):
+    return rotate_size(ImageSize(line.height, 3 * line.height), orientation.value)
+
+
+@cached_glyph(get_end_station_size)
+def get_end_station(line, orientation):
+    height = 3 * line.height
+    x = numpy.arange(line.height)[numpy.newaxis, :]
+    y = numpy.arange(height)[:, numpy.newaxis]
+
+    dist = numpy.select(
+        [
+            y <= line.height // 2,
+            y >= height - 1 - line.height // 2,
+            x >= line.height // 2,
+        ],
+        [
+            numpy.minimum(y, numpy.minimum(x, line.height - 1 - x)),
+            numpy.minimum(height - 1 - y, numpy.minimum(x, line.height - 1 - x)),
+            line.height - 1 - x,
+        ],
+        line.height // 2 - numpy.minimum(line.height // 2 - x, abs(y - height // 2)),
+    )
+
+    end_station = get_glyph_image(line, dist)
     end_station.rotate(orientation.value)
 
     return end_station
 
 
-@lru_cache(maxsize=10)
-def get_station(line, orientation):
-    station = Image(width=2 * line.height, height=line.height)
-    station.virtual_pixel = 'transparent'
+def get_station_size(line, orientation):
+    return rotate_size(ImageSize(2 * line.height, line.height), orientation.value)
 
-    for x in range(station.width):
-        for y in range(station.height):
-            if x <= line.height // 2:
-                dist = line.height // 2 - abs(station.height // 2 - x)
-            elif x < line.height:
-                dist = line.height // 2 - min(x - station.height // 2, abs(y - station.height // 2))
-            else:
-                dist = min(y, line.height - 1 - y, station.width - 1 - x)
-
-            station[x, y] = line[0, dist]
 
+@cached_glyph(get_station_size)
+def get_station(line, orientation):
+    width = 2 * line.height
+    x = numpy.arange(width)[numpy.newaxis, :]
+    y = numpy.arange(line.height)[:, numpy.newaxis]
+
+    dist = numpy.select(
+        [
+            x <= line.height // 2,
+            x < line.height,
+        ],
+        [
+            line.height // 2 - abs(line.height // 2 - x),
+            line.height // 2 - numpy.minimum(x - line.height // 2, abs(y - line.height // 2)),
+        ],
+        numpy.minimum(y, numpy.minimum(line.height - 1 - y, width - 1 - x)),
+    )
+
+    station = get_glyph_image(line, dist)
     station.rotate(orientation.value)
 
     return station
 
 
-@lru_cache(maxsize=10)
+def get_transfer_size(line, line_type, orientation):
+    if line_type == 'metro':
+        return ImageSize(27, 27)
+    if line_type == 'mcd':
+        return ImageSize(29, 29)
+    return rotate_size(ImageSize(line.width, line.height), orientation.value)
+
+
+@cached_glyph(get_transfer_size)
 def get_transfer(line, line_type, orientation):
     transfer = line.clone()
     transfer.virtual_pixel = 'transparent'
@@ -107,11 +259,12 @@ def get_transfer(line, line_type, orientation):
         transfer.distort('arc', (360, 0))
         transfer.resize(29, 29)
 
-    base = Image(width=transfer.width, height=transfer.height)
-    for x in range(base.width):
-        for y in range(base.height):
-            if (x - base.width // 2) ** 2 + (y - base.height // 2) ** 2 <= 9 ** 2:
-                base[x, y] = Color('#FFFFFF')
+    x = numpy.arange(transfer.width)[numpy.newaxis, :]
+    y = numpy.arange(transfer.height)[:, numpy.newaxis]
+    disc = (x - transfer.width // 2) ** 2 + (y - transfer.height // 2) ** 2 <= 9 ** 2
+    base_pixels = numpy.zeros((transfer.height, transfer.width, 4), dtype=numpy.uint16)
+    base_pixels[disc] = numpy.iinfo(numpy.uint16).max
+    base = Image.from_array(base_pixels, channel_map="RGBA")
 
     base.composite(transfer)
 
@@ -121,11 +274,12 @@ def get_transfer(line, line_type, orientation):
     line_part_base.virtual_pixel = 'transparent'
     line_part_base.composite(line_part)
 
-    for i in range(line_part_base.height):
-        if 3 <= i < 6:
-            line_part_base[3, i] = line[0, i]
-            line_part_base[4, i] = line[0, i]
-            line_part_base[5, i] = line[0, i]
+    rows = get_line_column(line)[3:6]
+    if len(rows):
+        line_part_base.import_pixels(
+            3, 3, 3, len(rows), "RGBA", "short",
+            numpy.repeat(rows[:, numpy.newaxis, :], 3, axis=1).ravel().tolist(),
+        )
 
     if orientation.name in [Orientation.HORIZONTAL.name, Orientation.VERTICAL.name]:
         base.composite(line_part_base, top=(base.height - line.height) // 2)
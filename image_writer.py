@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utilities import get_image_blob
+
+
+class OutputStats:
+    def __init__(self):
+        self.images = 0
+        self.bytes = 0
+        self.render_time = 0.0
+        self.encode_time = 0.0
+        self.io_time = 0.0
+        self.wait_time = 0.0
+
+    def add(self, other):
+        self.images += other.images
+        self.bytes += other.bytes
+        self.render_time += other.render_time
+        self.encode_time += other.encode_time
+        self.io_time += other.io_time
+        self.wait_time += other.wait_time
+
+    def __str__(self):
+        return (
+            f"{self.images} images, {self.bytes // 1024} KiB: "
+            f"render {int(self.render_time * 1000)} ms, "
+            f"encode {int(self.encode_time * 1000)} ms, "
+            f"I/O {int(self.io_time * 1000)} ms, "
+            f"waiting for the encoder {int(self.wait_time * 1000)} ms"
+        )
+
+
+output_stats = OutputStats()
+
+
+class WriteError(Exception):
+    def __init__(self, message, written):
+        super().__init__(message)
+        self.written = written
+
+
+class ImageWriter:
+    # Finished images are handed over with submit and encoded and written
+    # by a thread pool, at most max_pending images wait so the renderer
+    # blocks instead of piling up images in memory
+    def __init__(self, threads=1, max_pending=4, compression_level=None, png_filter=None):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.compression_level = compression_level
+        self.png_filter = png_filter
+        self.lock = threading.Lock()
+        self.pending = []
+        self.written = []
+        self.stats = OutputStats()
+
+    def submit(self, image, filenames, close=True):
+        start_time = time.perf_counter()
+        self.slots.acquire()
+        self.stats.wait_time += time.perf_counter() - start_time
+
+        try:
+            future = self.executor.submit(self.write, image, filenames, close)
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending.append(future)
+
+    def write(self, image, filenames, close):
+        try:
+            image_format = os.path.splitext(filenames[0])[1][1:].lower() or "png"
+            start_time = time.perf_counter()
+            try:
+                blob = get_image_blob(image, image_format, self.compression_level, self.png_filter)
+            finally:
+                if close:
+                    image.close()
+            encode_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            for filename in filenames:
+                try:
+                    with open(filename, "wb") as file:
+                        file.write(blob)
+                except OSError:
+                    # a truncated file must not be taken for a finished one
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    raise
+                with self.lock:
+                    self.written.append(filename)
+            io_time = time.perf_counter() - start_time
+
+            with self.lock:
+                self.stats.images += 1
+                self.stats.bytes += len(blob) * len(filenames)
+                self.stats.encode_time += encode_time
+                self.stats.io_time += io_time
+        finally:
+            self.slots.release()
+
+    def flush(self):
+        # every write is waited for, the first failure is raised once all
+        # of them are done so written lists every file that made it to disk
+        with self.lock:
+            pending, self.pending = self.pending, []
+        errors = []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Could not write an image: {e}")
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+        return self.stats
+
+
+writer_options = {"threads": 1, "max_pending": 4, "compression_level": None, "png_filter": None}
+
+
+def set_writer_options(threads, compression_level, png_filter):
+    writer_options.update(
+        threads=threads,
+        max_pending=4 * threads,
+        compression_level=compression_level,
+        png_filter=png_filter,
+    )
+
+
+def create_writer(**options):
+    return ImageWriter(**{**writer_options, **options})
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import time
+
+from wand.color import Color
+from wand.image import Image
+
+from image_writer import create_writer, output_stats
+from map_data import INFO_OWNER, Station
+from render_cache import get_key, get_line_style, get_map_assets
+from utilities import get_file_hash, get_union, intersects
+
+INCREMENTAL_STATE_VERSION = 2
+
+LABEL_KEYS = ("name", "name_offset", "name_relative_to", "hide_name")
+
+
+def get_map_key(map_data, size):
+    return get_key(
+        "map",
+        INCREMENTAL_STATE_VERSION,
+        size,
+        get_file_hash(
+            os.path.join(map_data.assets_path, "images", map_data.map_data_json["info_filename"])
+        ),
+        get_map_assets(map_data),
+    )
+
+
+def get_owner_keys(map_data):
+    # every owner is keyed by what its drawing depends on: a station label
+    # only by its text and position, so renaming a station leaves the path
+    # of its line clean
+    parts = {}
+    for line in map_data.lines:
+        stations = [element for element in line.elements if isinstance(element, Station)]
+        parts.setdefault(line.owner, []).append(
+            [
+                get_line_style(line),
+                [
+                    {key: value for key, value in element.items() if key not in LABEL_KEYS}
+                    for element in line.line_json["elements"]
+                ],
+                [station.is_transfer() for station in stations],
+            ]
+        )
+        for station in stations:
+            parts.setdefault(station.label_owner, []).append(
+                [getattr(station, key) for key in LABEL_KEYS] + [station.position]
+            )
+
+    for transfer in map_data.transfers:
+        parts.setdefault(transfer.owner, []).append(
+            [
+                transfer.transfer_json,
+                [
+                    (station.position, get_line_style(station.line))
+                    for station in transfer.stations
+                ],
+            ]
+        )
+
+    parts[INFO_OWNER] = [(line.name, get_line_style(line)) for line in map_data.lines]
+    return {owner: get_key(owner, owner_parts) for owner, owner_parts in parts.items()}
+
+
+def get_owner_bounds(geometry):
+    owner_bounds = {}
+    for bounds, item in geometry.entries:
+        if item.owner is not None:
+            previous_bounds = owner_bounds.get(item.owner)
+            owner_bounds[item.owner] = (
+                bounds if previous_bounds is None else get_union(previous_bounds, bounds)
+            )
+    return owner_bounds
+
+
+def get_state(map_data, geometry, size):
+    owner_bounds = get_owner_bounds(geometry)
+    return {
+        "map": get_map_key(map_data, size),
+        "owners": {
+            owner: [key, owner_bounds.get(owner)]
+            for owner, key in get_owner_keys(map_data).items()
+        },
+    }
+
+
+def load_state(filename):
+    try:
+        with open(filename, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(filename, state):
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(state, file, sort_keys=True, ensure_ascii=False)
+
+
+def clip(bounds, size):
+    left, top = max(bounds[0], 0), max(bounds[1], 0)
+    right = min(bounds[0] + bounds[2], size[0])
+    bottom = min(bounds[1] + bounds[3], size[1])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right - left, bottom - top
+
+
+def merge_bounds(bounds_list):
+    merged = []
+    for bounds in bounds_list:
+        while True:
+            for num, other in enumerate(merged):
+                if intersects(bounds, other):
+                    bounds = get_union(bounds, merged.pop(num))
+                    break
+            else:
+                break
+        merged.append(bounds)
+    return merged
+
+
+def get_dirty_bounds(previous, state, size):
+    owners = set(previous["owners"]) | set(state["owners"])
+    dirty = []
+    for owner in sorted(owners):
+        previous_key, previous_bounds = previous["owners"].get(owner, (None, None))
+        key, bounds = state["owners"].get(owner, (None, None))
+        if previous_key == key:
+            continue
+        logging.info(f"{owner} changed")
+        for owner_bounds in [previous_bounds, bounds]:
+            if owner_bounds is not None:
+                owner_bounds = clip(owner_bounds, size)
+                if owner_bounds is not None:
+                    dirty.append(owner_bounds)
+    return merge_bounds(dirty)
+
+
+def repaint(image, display_list, bounds):
+    # everything that overlaps the region is replayed in drawing order, so
+    # lines keep their priority order over the unchanged parts of the map
+    region = Image(width=bounds[2], height=bounds[3], background=Color("white"))
+    with region:
+        operations_count = display_list.replay(region, bounds[:2])
+        image.composite(region, left=bounds[0], top=bounds[1])
+    return operations_count
+
+
+def draw_incremental(map_data, filename, cell_size=512):
+    # the dirty regions come from the geometry alone, the map is only
+    # recorded for drawing when something has to be repainted
+    state_filename = filename + ".state.json"
+    size = (map_data.image_resolution[1], map_data.image_resolution[0])
+    state = get_state(map_data, map_data.get_geometry(cell_size), size)
+    previous = load_state(state_filename)
+
+    image = None
+    if (
+            previous is not None
+            and previous.get("map") == state["map"]
+            and os.path.exists(filename)
+    ):
+        image = Image(filename=filename)
+        if image.size != size:
+            image.close()
+            image = None
+
+    if image is None:
+        logging.info("No usable previous render, drawing the whole map")
+        dirty = [(0, 0, *size)]
+        image = Image(width=size[0], height=size[1], background=Color("white"))
+    else:
+        dirty = get_dirty_bounds(previous, state, size)
+
+    start_time = time.perf_counter()
+    if dirty:
+        display_list = map_data.get_display_list(cell_size=cell_size)
+    for bounds in dirty:
+        operations_count = repaint(image, display_list, bounds)
+        logging.info(f"Repainted {bounds} with {operations_count} operations")
+    output_stats.render_time += time.perf_counter() - start_time
+
+    if dirty:
+        writer = create_writer()
+        writer.submit(image, [filename])
+        output_stats.add(writer.close())
+    else:
+        image.close()
+    save_state(state_filename, state)
+    return dirty
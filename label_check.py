@@ -0,0 +1,60 @@
+from typing import NamedTuple, Tuple
+
+from utilities import ItemKind, MapItem, intersects
+
+
+class Collision(NamedTuple):
+    label: MapItem
+    label_bounds: Tuple[int, int, int, int]
+    other: MapItem
+    other_bounds: Tuple[int, int, int, int]
+
+
+def grow(bounds, margin):
+    return (
+        bounds[0] - margin,
+        bounds[1] - margin,
+        bounds[2] + 2 * margin,
+        bounds[3] + 2 * margin,
+    )
+
+
+def find_label_collisions(map_data, margin=0):
+    # labels are checked against the geometry the renderer draws, a label
+    # may touch the marker of its own station, and every pair of labels is
+    # reported once with both labels grown by the margin
+    geometry = map_data.get_geometry()
+    label_order = {
+        item: num for num, (_, item) in enumerate(geometry.entries) if item.kind == ItemKind.LABEL
+    }
+    collisions = []
+
+    for bounds, label in geometry.entries:
+        if label.kind != ItemKind.LABEL:
+            continue
+        bounds = grow(bounds, margin)
+        # a transfer is indexed shape by shape but reported once
+        found = set()
+        for other_bounds, other in geometry.query(grow(bounds, margin)):
+            if other in found or other == label:
+                continue
+            if other.kind == ItemKind.STATION and other.name == label.name:
+                continue
+            if other.kind == ItemKind.LABEL:
+                if label_order[other] > label_order[label]:
+                    continue
+                other_bounds = grow(other_bounds, margin)
+            if not intersects(bounds, other_bounds):
+                continue
+            found.add(other)
+            collisions.append(Collision(label, bounds, other, other_bounds))
+
+    return collisions
+
+
+def get_overlap_area(bounds1, bounds2):
+    if not intersects(bounds1, bounds2):
+        return 0
+    width = min(bounds1[0] + bounds1[2], bounds2[0] + bounds2[2]) - max(bounds1[0], bounds2[0])
+    height = min(bounds1[1] + bounds1[3], bounds2[1] + bounds2[3]) - max(bounds1[1], bounds2[1])
+    return width * height
@@ -1,6 +1,8 @@
 import argparse
+import asyncio
 import logging
 import pathlib
+import time
 
 from transliterate import translit
 
@@ -8,7 +10,19 @@ import datetime
 import json
 import os
 
-from map_data import MapData, Station
+from draw_elements import glyph_cache
+from image_writer import WriteError, create_writer, output_stats, set_writer_options
+from map_data import MapData, Station, draw_options
+from incremental import draw_incremental
+from label_check import find_label_collisions, get_overlap_area
+import raster_cache
+from raster_backend import BACKENDS, draw_map, get_pixel_difference
+from render_cache import RenderCache, get_linear_map_key, get_station_sign_key
+from render_jobs import render_linear_map, render_station_sign, run_jobs
+from server import RenderServer
+from svg_map import write_svg_map
+from tiles import export_tiles, write_tiled_png
+from utilities import PNG_FILTERS
 
 
 def format_filename(filename):
@@ -20,13 +34,93 @@ def draw_full_map(args):
 
     os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
 
-    metro_map = map_data.draw()
-    metro_map.save(filename=args.output)
+    if args.format == "svg":
+        output = os.path.splitext(args.output)[0] + ".svg"
+        elements_count = write_svg_map(map_data, output)
+        print(f"Wrote {elements_count} vector elements to {output}")
+        return
 
+    if args.tile_size or args.incremental:
+        if not args.output.lower().endswith(".png"):
+            print("Tiled and incremental rendering only write PNG files")
+            return
 
-def draw_linear_map(args):
+    if args.incremental:
+        dirty = draw_incremental(map_data, args.output)
+        print(f"Repainted {len(dirty)} regions, {sum(w * h for _, _, w, h in dirty)} pixels")
+        return
+
+    if args.tile_size:
+        write_tiled_png(map_data, args.output, args.tile_size)
+        return
+
+    start_time = time.perf_counter()
+    metro_map = draw_map(map_data, args.backend)
+    output_stats.render_time += time.perf_counter() - start_time
+    writer = create_writer()
+    writer.submit(metro_map, [args.output], close=False)
+
+    with metro_map:
+        if args.compare:
+            # the other map is drawn while the first one is being written
+            other_backend = "numpy" if args.backend == "wand" else "wand"
+            with draw_map(map_data, other_backend) as other_map:
+                output_stats.add(writer.close())
+                max_difference, mean_difference = get_pixel_difference(metro_map, other_map)
+            print(
+                f"Difference to the {other_backend} backend: "
+                f"max {max_difference:.6f}, mean {mean_difference:.6f}"
+            )
+        else:
+            output_stats.add(writer.close())
+
+
+def export_map_tiles(args):
     map_data = MapData(json.loads(args.map_data.read()), args.assets)
 
+    output = os.path.splitext(args.output)[0]
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    pyramid = export_tiles(map_data, output, args.tile_size, args.jobs)
+
+    print(
+        f"Exported {pyramid.tiles_written} tiles in {pyramid.max_level + 1} levels, "
+        f"skipped {pyramid.tiles_skipped} empty tiles"
+    )
+
+
+def get_linear_map_jobs(lines, output):
+    jobs = []
+    for line in lines:
+        for element in line.elements:
+            if isinstance(element, Station):
+                for reverse_direction in [0, 1]:
+                    jobs.append(
+                        (
+                            line.name,
+                            element.name,
+                            reverse_direction,
+                            os.path.join(
+                                output,
+                                format_filename(
+                                    "linear_"
+                                    + line.name
+                                    + "_"
+                                    + element.name
+                                    + "_"
+                                    + str(reverse_direction)
+                                    + ".png"
+                                ),
+                            ),
+                        )
+                    )
+    return jobs
+
+
+def draw_linear_map(args):
+    map_data_text = args.map_data.read()
+    map_data = MapData(json.loads(map_data_text), args.assets)
+
     if args.all:
         lines = map_data.lines
     else:
@@ -38,59 +132,189 @@ def draw_linear_map(args):
 
     os.makedirs(args.output, exist_ok=True)
 
-    for i, line in enumerate(lines):
-        logging.info(f"[{i + 1} / {len(lines)}] Rendering {line.name}")
+    render_cache = RenderCache(args.output, not args.force)
+    jobs = []
+    keys = {}
+    for job in get_linear_map_jobs(lines, args.output):
+        line_name, station_name, reverse_direction, filename = job
+        keys[filename] = get_linear_map_key(
+            map_data.get_line(line_name), station_name, reverse_direction
+        )
+        if not render_cache.is_fresh(filename, keys[filename]):
+            jobs.append(job)
+
+    error = None
+    try:
+        written = run_jobs(
+            render_linear_map, jobs, map_data, map_data_text, args.assets, args.jobs
+        )
+    except WriteError as e:
+        written, error = e.written, e
+
+    rendered = {job[-1] for job in jobs}
+    for filename, key in keys.items():
+        if filename not in rendered or filename in written:
+            render_cache.update(filename, key)
+        else:
+            render_cache.discard(filename)
+    render_cache.save()
+    if error is not None:
+        raise error
+
+    print(
+        f"Rendered {len(lines)} lines, {len(keys) - len(jobs)} of {len(keys)} maps were up to date"
+    )
+
+
+def parse_size(size):
+    try:
+        width, height = size.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {size!r}, expected WIDTHxHEIGHT")
+
+
+def get_station_sign_jobs(lines, stations, output, sizes, transfers, size_suffix=False):
+    # a transfer hub gets the same sign on each of its lines when transfers
+    # are shown, so every distinct sign is rendered once and written to all
+    # of its files
+    jobs = {}
+    for line in lines:
         for element in line.elements:
             if isinstance(element, Station):
-                for reverse_direction in [0, 1]:
-                    linear_metro_map = line.get_linear_metro_map(
-                        reverse_direction, element.name
-                    )
-
-                    linear_metro_map.save(
-                        filename=os.path.join(
-                            args.output,
+                if stations is not None and element.name not in stations:
+                    continue
+                keys = tuple(
+                    get_station_sign_key(element, width, height, transfers)
+                    for width, height in sizes
+                )
+                if keys not in jobs:
+                    jobs[keys] = (line.name, element.name, transfers, [[] for _ in sizes])
+                for (width, height), filenames in zip(sizes, jobs[keys][-1]):
+                    filenames.append(
+                        os.path.join(
+                            output,
                             format_filename(
-                                "linear_"
+                                "sign_"
                                 + line.name
                                 + "_"
                                 + element.name
-                                + "_"
-                                + str(reverse_direction)
+                                + (f"_{width}x{height}" if size_suffix else "")
                                 + ".png"
                             ),
                         )
                     )
-
-    print(f"Rendered {len(lines)} lines")
+    return jobs
 
 
 def draw_station_sign(args):
-    map_data = MapData(json.loads(args.map_data.read()), args.assets)
+    map_data_text = args.map_data.read()
+    map_data = MapData(json.loads(map_data_text), args.assets)
 
     if args.all_lines:
         lines = map_data.lines
     else:
         lines = [line for line in map_data.lines if line.name in args.lines]
 
-    for i, line in enumerate(lines):
-        for element in line.elements:
-            if isinstance(element, Station):
-                if not args.all_stations and element.name not in args.stations:
-                    continue
-                station_sign = element.get_sign_image(args.width, args.height, args.transfers)
-                station_sign.save(
-                    filename=os.path.join(
-                        args.output,
-                        format_filename(
-                            "sign_"
-                            + line.name
-                            + "_"
-                            + element.name
-                            + ".png"
-                        ),
-                    )
-                )
+    if not lines:
+        print("No lines to render")
+        return
+
+    os.makedirs(args.output, exist_ok=True)
+
+    sizes = list(dict.fromkeys(args.sizes)) or [(args.width, args.height)]
+    render_cache = RenderCache(args.output, not args.force)
+    sign_jobs = get_station_sign_jobs(
+        lines,
+        None if args.all_stations else args.stations,
+        args.output,
+        sizes,
+        args.transfers,
+        bool(args.sizes),
+    )
+    jobs = []
+    signs_count = 0
+    files_count = 0
+    for keys, (line_name, station_name, transfers, size_filenames) in sign_jobs.items():
+        outputs = []
+        for (width, height), key, filenames in zip(sizes, keys, size_filenames):
+            files_count += len(filenames)
+            if not all(render_cache.is_fresh(filename, key) for filename in filenames):
+                outputs.append((width, height, tuple(filenames)))
+        if outputs:
+            jobs.append((line_name, station_name, transfers, tuple(outputs)))
+            signs_count += len(outputs)
+
+    error = None
+    try:
+        written = run_jobs(
+            render_station_sign, jobs, map_data, map_data_text, args.assets, args.jobs
+        )
+    except WriteError as e:
+        written, error = e.written, e
+
+    rendered = {
+        filename for job in jobs for _, _, filenames in job[-1] for filename in filenames
+    }
+    for keys, job in sign_jobs.items():
+        for key, filenames in zip(keys, job[-1]):
+            for filename in filenames:
+                if filename not in rendered or filename in written:
+                    render_cache.update(filename, key)
+                else:
+                    render_cache.discard(filename)
+    render_cache.save()
+    if error is not None:
+        raise error
+
+    print(
+        f"Rendered {signs_count} of {len(sign_jobs) * len(sizes)} distinct signs for {files_count} files"
+    )
+
+
+def check_labels(args):
+    map_data = MapData(json.loads(args.map_data.read()), args.assets)
+
+    collisions = find_label_collisions(map_data, args.margin)
+    for collision in collisions:
+        print(
+            f"Label {collision.label.name} overlaps {collision.other.kind.value} "
+            f"{collision.other.name} by "
+            f"{get_overlap_area(collision.label_bounds, collision.other_bounds)} pixels"
+        )
+    print(f"Found {len(collisions)} label collisions")
+    if collisions:
+        raise SystemExit(1)
+
+
+def serve_map(args):
+    args.map_data.close()
+    server = RenderServer(args.map_data.name, args.assets, args.jobs, args.max_pending)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+def show_cache_stats(args):
+    if not os.path.isdir(args.cache_dir):
+        print(f"No cache at {args.cache_dir}")
+        return
+
+    disk_cache = raster_cache.DiskCache(args.cache_dir)
+    if args.clear:
+        disk_cache.clear()
+        print(f"Cleared {args.cache_dir}")
+        return
+
+    entries = disk_cache.entries.values()
+    print(f"Entries: {len(entries)}")
+    print(f"Size: {disk_cache.get_size() / 1024 / 1024:.1f} MB")
+    if entries:
+        oldest = min(mtime for _, mtime in entries)
+        newest = max(mtime for _, mtime in entries)
+        print(f"Least recently used: {datetime.datetime.fromtimestamp(oldest)}")
+        print(f"Most recently used: {datetime.datetime.fromtimestamp(newest)}")
 
 
 def main():
@@ -111,6 +335,56 @@ def main():
     parent_parser.add_argument(
         "-v", "--verbose", action="count", default=0, help="verbosity"
     )
+    parent_parser.add_argument(
+        "--glyph-cache-size",
+        default=256,
+        type=int,
+        help="number of line glyphs kept in memory",
+    )
+    parent_parser.add_argument(
+        "--cache-dir",
+        default=None,
+        type=str,
+        help="folder keeping rendered glyphs and texts between runs",
+    )
+    parent_parser.add_argument(
+        "--cache-size",
+        default=256,
+        type=int,
+        help="size limit of the cache folder in megabytes",
+    )
+
+    parent_parser.add_argument(
+        "--compression-level",
+        default=None,
+        type=int,
+        choices=range(10),
+        help="zlib level of written PNG files, ImageMagick picks one by default",
+    )
+    parent_parser.add_argument(
+        "--png-filter",
+        default=None,
+        choices=list(PNG_FILTERS),
+        help="row filter of written PNG files, ImageMagick picks one by default",
+    )
+    parent_parser.add_argument(
+        "--batch-segments",
+        action="store_true",
+        help="fill line segments of one colour in a single drawing pass instead of compositing them",
+    )
+    parent_parser.add_argument(
+        "--write-threads",
+        default=1,
+        type=int,
+        help="number of threads encoding and writing images in every render process",
+    )
+
+    cache_parser = argparse.ArgumentParser(add_help=False)
+    cache_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="render every file even if it is up to date",
+    )
 
     full_parser = subparsers.add_parser(
         "full", parents=[parent_parser], help="Draw the complete metro map"
@@ -122,10 +396,65 @@ def main():
         type=str,
         help="name of the output file",
     )
+    full_parser.add_argument(
+        "--tile-size",
+        default=0,
+        type=int,
+        help="render the map in square tiles of this size to bound memory use",
+    )
+    full_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="repaint only the parts of the previous render that changed",
+    )
+    full_parser.add_argument(
+        "--format",
+        default="raster",
+        choices=["raster", "svg"],
+        help="draw raster glyphs or write the map as vector primitives",
+    )
+    full_parser.add_argument(
+        "--backend",
+        default="wand",
+        choices=sorted(BACKENDS),
+        help="compositor for raster output",
+    )
+    full_parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="also render with the other backend and report the pixel difference",
+    )
     full_parser.set_defaults(func=draw_full_map)
 
+    tiles_parser = subparsers.add_parser(
+        "export-tiles",
+        parents=[parent_parser],
+        help="Export the complete metro map as a Deep Zoom tile pyramid",
+    )
+    tiles_parser.add_argument(
+        "-o",
+        "--output",
+        default="./output/metro_map.dzi",
+        type=str,
+        help="name of the .dzi manifest, tiles go to the matching _files folder",
+    )
+    tiles_parser.add_argument(
+        "--tile-size",
+        default=256,
+        type=int,
+        help="size of the tiles in pixels",
+    )
+    tiles_parser.add_argument(
+        "-j",
+        "--jobs",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="number of threads writing tiles",
+    )
+    tiles_parser.set_defaults(func=export_map_tiles)
+
     linear_parser = subparsers.add_parser(
-        "linear", parents=[parent_parser], help="Draw the linear map for a station"
+        "linear", parents=[parent_parser, cache_parser], help="Draw the linear map for a station"
     )
     linear_parser.add_argument(
         "-l",
@@ -143,10 +472,17 @@ def main():
         type=pathlib.Path,
         help="name of the output folder",
     )
+    linear_parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="number of worker processes",
+    )
     linear_parser.set_defaults(func=draw_linear_map)
 
     station_parser = subparsers.add_parser(
-        "station", parents=[parent_parser], help='Draw the station entrance sign'
+        "station", parents=[parent_parser, cache_parser], help='Draw the station entrance sign'
     )
     station_parser.add_argument(
         "-l",
@@ -188,14 +524,79 @@ def main():
         type=int,
         help="height of the sign in pixels",
     )
+    station_parser.add_argument(
+        "--sizes",
+        action="extend",
+        nargs="+",
+        default=[],
+        type=parse_size,
+        help="sign sizes as WIDTHxHEIGHT, overrides --width and --height and adds the size to file names",
+    )
     station_parser.add_argument(
         "--transfers",
         default=False,
         action="store_true",
         help="show transfer lines on signs"
     )
+    station_parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="number of worker processes",
+    )
     station_parser.set_defaults(func=draw_station_sign)
 
+    check_parser = subparsers.add_parser(
+        "check", parents=[parent_parser], help="Report station labels that overlap the map"
+    )
+    check_parser.add_argument(
+        "--margin",
+        default=0,
+        type=int,
+        help="free space in pixels required around every label",
+    )
+    check_parser.set_defaults(func=check_labels)
+
+    serve_parser = subparsers.add_parser(
+        "serve", parents=[parent_parser], help="Answer render requests over HTTP"
+    )
+    serve_parser.add_argument(
+        "--host", default="127.0.0.1", help="address to listen on"
+    )
+    serve_parser.add_argument(
+        "--port", default=8080, type=int, help="port to listen on"
+    )
+    serve_parser.add_argument(
+        "--socket", default=None, type=str, help="listen on a Unix socket instead of a port"
+    )
+    serve_parser.add_argument(
+        "-j",
+        "--jobs",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="number of render threads",
+    )
+    serve_parser.add_argument(
+        "--max-pending",
+        default=64,
+        type=int,
+        help="number of distinct renders queued before requests are refused",
+    )
+    serve_parser.set_defaults(func=serve_map)
+
+    cache_stats_parser = subparsers.add_parser(
+        "cache-stats", help="Show the contents of a glyph and text cache folder"
+    )
+    cache_stats_parser.add_argument("cache_dir", type=str, help="path to the cache folder")
+    cache_stats_parser.add_argument(
+        "--clear", action="store_true", help="remove every cached entry"
+    )
+    cache_stats_parser.add_argument(
+        "-v", "--verbose", action="count", default=0, help="verbosity"
+    )
+    cache_stats_parser.set_defaults(func=show_cache_stats)
+
     args = parser.parse_args()
 
     if args.verbose == 1:
@@ -203,10 +604,26 @@ def main():
     if args.verbose >= 2:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    if args.command != "cache-stats":
+        glyph_cache.maxsize = args.glyph_cache_size
+        raster_cache.set_disk_cache(args.cache_dir, args.cache_size * 1024 * 1024)
+        set_writer_options(args.write_threads, args.compression_level, args.png_filter)
+        draw_options["batch_segments"] = args.batch_segments
+
     start_time = datetime.datetime.now()
 
     args.func(args)
 
+    logging.info(
+        f"Glyph cache: {glyph_cache.hits} hits, {glyph_cache.misses} misses"
+    )
+    if raster_cache.disk_cache is not None:
+        logging.info(
+            f"Disk cache: {raster_cache.disk_cache.hits} hits, {raster_cache.disk_cache.misses} misses"
+        )
+
+    if output_stats.images:
+        print(f"Output: {output_stats}")
     print(
         f"Generating completed in {int((datetime.datetime.now() - start_time).total_seconds() * 1000)} ms"
     )
@@ -5,29 +5,46 @@ import transliterate
 from utilities import *
 from draw_elements import *
 
-from typing import Dict, Any, List
-from functools import cmp_to_key
-import copy
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+from functools import cached_property, cmp_to_key
 
 
 class Element:
     def __init__(self, line: "Line", is_planned: bool):
         self.line = line
         self.is_planned = is_planned
+        self.index = None
+        self.actually_planned = None
 
     def is_actually_planned(self):
-        num = self.line.elements.index(self)
-        for slice_ in (self.line.elements[num:], self.line.elements[: num + 1]):
-            for element in slice_:
-                if element.is_planned is not None:
-                    if element.is_planned:
-                        return True
-                    else:
-                        break
-                elif isinstance(element, Station):
-                    break
+        return self.actually_planned
+
+
+def get_planned_flags(sequence):
+    # sequence holds (is_planned, is_station) pairs; a position is planned if
+    # the nearest flag ahead of it up to a station is set, or if the first
+    # flag of the line (before any station) is set and lies at or before it
+    flags = [False] * len(sequence)
 
-        return False
+    forward = False
+    for num in reversed(range(len(sequence))):
+        is_planned, is_station = sequence[num]
+        if is_planned is not None:
+            forward = bool(is_planned)
+        elif is_station:
+            forward = False
+        flags[num] = forward
+
+    for num, (is_planned, is_station) in enumerate(sequence):
+        if is_planned is not None:
+            if is_planned:
+                for i in range(num, len(sequence)):
+                    flags[i] = True
+            break
+        elif is_station:
+            break
+
+    return flags
 
 
 class LineSegment(Element):
@@ -70,10 +87,29 @@ class Station(Element):
     def full_name(self):
         return self.line.name, self.name
 
+    def get_label_bounds(self, font_path):
+        if self.hide_name:
+            return None
+        return get_place_bounds(
+            get_text_size(self.name, font_path),
+            (
+                self.position[0] + self.name_offset[0],
+                self.position[1] + self.name_offset[1],
+            ),
+            RelativeTo[self.name_relative_to.upper()],
+        )
+
+    @property
+    def label_owner(self):
+        return f"label:{self.line.name}:{self.name}"
+
     def is_transfer(self):
         return len(self.transfers) > 0
 
     def get_transfer_stations(self):
+        return self.line.map_data.transfer_graph.get_transfer_stations(self)
+
+    def get_transfer_stations_reference(self):
         transfer_stations = set()
         self.get_transfer_stations_rec(transfer_stations)
         transfer_stations.remove(self)
@@ -96,46 +132,30 @@ class Station(Element):
                 )
 
     def get_transfer_lines(self):
+        return self.line.map_data.transfer_graph.get_transfer_lines(self)
+
+    def get_transfer_lines_reference(self):
         transfer_lines = set()
-        for transfer_station in self.get_transfer_stations():
+        for transfer_station in self.get_transfer_stations_reference():
             transfer_lines.add(transfer_station.line)
 
         if self.line in transfer_lines:
             transfer_lines.remove(self.line)
         return transfer_lines
 
-    def get_sign_image(self, width, height, transfer_rendering=True):
+    def get_sign_content(self, transfer_rendering=True):
         lines = [self.line]
 
         if transfer_rendering:
             transfer_lines = list(self.get_transfer_lines())
             lines.extend(transfer_lines)
-            lines.sort(key=lambda l: l.map_data.lines.index(l))
-
-        logos_image = None
-
-        for i, transfer_line in enumerate(lines):
-            line_logo = transfer_line.logo_image
-            line_logo.resize(round(
-                line_logo.width
-                / (line_logo.height / 48)
-            ), 48)
-
-            spacing = 16
-            if i > 0 and lines[i - 1].type == "mcd" and transfer_line.type == "mcd":
-                spacing = -10
-
-            if i > 0:
-                temp_image = Image(width=logos_image.width + spacing + line_logo.width, height=logos_image.height)
-                place(temp_image, logos_image, (0, 0), RelativeTo.TOP_LEFT)
-                place(temp_image, line_logo, (temp_image.width - 1, temp_image.height // 2), RelativeTo.RIGHT)
-                logos_image = temp_image
-            else:
-                logos_image = line_logo
+            lines.sort(key=lambda l: l.index)
+
+        logos_image = self.line.map_data.get_logo_strip(lines, 48)
 
-        text_image = get_text_image(self.name, logos_image, self.line.map_data.font_path, font_size=30)
+        text_image = get_text_image(self.name, self.line.map_data.font_path, font_size=30)
         translit_name = transliterate.translit(self.name, 'ru', reversed=True)
-        translit_text_image = get_text_image(translit_name, logos_image, self.line.map_data.font_path,
+        translit_text_image = get_text_image(translit_name, self.line.map_data.font_path,
                                              font_color=Color("gray"), font_size=18)
 
         combined_text_image = Image(width=max(text_image.width, translit_text_image.width),
@@ -148,6 +168,9 @@ class Station(Element):
         place(content_image, logos_image, (0, content_image.height // 2), RelativeTo.LEFT)
         place(content_image, combined_text_image, (logos_image.width + 16, content_image.height // 2), RelativeTo.LEFT)
 
+        return content_image
+
+    def get_sign_frame(self, content_image, width, height):
         frame_size = 4
 
         sign_image = Image(width=width - frame_size * 2, height=height - frame_size * 2, background=Color("#FFFFFFFF"))
@@ -166,6 +189,56 @@ class Station(Element):
 
         return frame
 
+    def get_sign_images(self, sizes, transfer_rendering=True):
+        # the logos and text do not depend on the sign size, so they are laid
+        # out once and only the frame is made for each size
+        with self.get_sign_content(transfer_rendering) as content_image:
+            return [self.get_sign_frame(content_image, width, height) for width, height in sizes]
+
+    def get_sign_image(self, width, height, transfer_rendering=True):
+        return self.get_sign_images([(width, height)], transfer_rendering)[0]
+
+
+class StationPlacement(NamedTuple):
+    station: Station
+    position: Tuple[int, int]
+    orientation: str
+    name_relative_to: str
+    name_offset: Tuple[int, int]
+    hide_name: bool
+
+    @property
+    def name(self):
+        return self.station.name
+
+    @property
+    def line(self):
+        return self.station.line
+
+    def is_transfer(self):
+        return self.station.is_transfer()
+
+
+class SegmentPlacement(NamedTuple):
+    length: int
+
+
+class TransferLogoSlot(NamedTuple):
+    line: "Line"
+    position: Tuple[int, int]
+
+
+class LinearLayout(NamedTuple):
+    width: int
+    start: Tuple[int, int]
+    path: Tuple[Any, ...]
+    planned: Tuple[bool, ...]
+    stations: Tuple[StationPlacement, ...]
+    transfer_logos: Tuple[TransferLogoSlot, ...]
+    direction_station: Optional[str]
+    reverse_direction_station: Optional[str]
+    highlighted_station: Optional[StationPlacement]
+
 
 class Line:
     @staticmethod
@@ -174,51 +247,11 @@ class Line:
 
     def __init__(self, map_data, line_json):
         self.map_data = map_data
+        self.line_json = line_json
         self.name = line_json.get("name")
+        self.owner = f"line:{self.name}"
 
-        if "line_filename" in line_json:
-            self.line_image = Image(
-                filename=os.path.join(
-                    self.map_data.assets_path, "images", line_json.get("line_filename")
-                )
-            )
-        else:
-            self.line_image = Image(
-                width=1, height=9, background=Color(line_json["line_color"])
-            )
-
-        if "planned_line_filename" in line_json:
-            self.planned_line_image = Image(
-                filename=os.path.join(
-                    self.map_data.assets_path,
-                    "images",
-                    line_json.get("planned_line_filename"),
-                )
-            )
-        elif "planned_line_color" in line_json:
-            self.planned_line_image = Image(
-                width=1, height=9, background=Color(line_json["planned_line_color"])
-            )
-        else:
-            self.planned_line_image = None
-
-        self.logo_image = Image(
-            filename=os.path.join(
-                self.map_data.assets_path, "images", line_json.get("logo_filename")
-            )
-        )
-
-        self.logo_image_resized = Image(self.logo_image)
-        self.logo_image_resized.resize(
-            int(
-                round(
-                    self.logo_image_resized.width
-                    / (self.logo_image_resized.height / (self.line_image.height * 3))
-                )
-                + 0.5
-            ),
-            self.line_image.height * 3,
-        )
+        self.logo_images = {}
 
         self.type = line_json.get("type")
         self.priority = line_json.get("priority")
@@ -250,6 +283,88 @@ class Line:
             if element["type"] == "station":
                 self.elements.append(Station(self, element, cur_pos))
 
+        self.stations_by_name: Dict[str, Station] = {}
+        for index, element in enumerate(self.elements):
+            element.index = index
+            if isinstance(element, Station):
+                self.stations_by_name.setdefault(element.name, element)
+
+        planned_flags = get_planned_flags(
+            [
+                (element.is_planned, isinstance(element, Station))
+                for element in self.elements
+            ]
+        )
+        for element, actually_planned in zip(self.elements, planned_flags):
+            element.actually_planned = actually_planned
+
+    def get_image_path(self, key):
+        return os.path.join(self.map_data.assets_path, "images", self.line_json[key])
+
+    @cached_property
+    def line_image(self):
+        if "line_filename" in self.line_json:
+            return load_image(self.get_image_path("line_filename"))
+        return Image(width=1, height=9, background=Color(self.line_json["line_color"]))
+
+    @cached_property
+    def planned_line_image(self):
+        if "planned_line_filename" in self.line_json:
+            return load_image(self.get_image_path("planned_line_filename"))
+        if "planned_line_color" in self.line_json:
+            return Image(
+                width=1, height=9, background=Color(self.line_json["planned_line_color"])
+            )
+        return None
+
+    @cached_property
+    def logo_image(self):
+        return load_image(self.get_image_path("logo_filename"))
+
+    @cached_property
+    def logo_image_resized(self):
+        logo_image_resized = Image(self.logo_image)
+        logo_image_resized.resize(*self.get_logo_size())
+        return logo_image_resized
+
+    def get_logo_size(self):
+        height = self.line_image.height * 3
+        return (
+            int(round(self.logo_image.width / (self.logo_image.height / height)) + 0.5),
+            height,
+        )
+
+    def get_logo_centers(self):
+        centers = []
+        first_element = self.elements[0]
+        if isinstance(first_element, Station) and self.start_logo_offset is not None:
+            centers.append(
+                (
+                    first_element.position[0] + self.start_logo_offset[0],
+                    first_element.position[1] + self.start_logo_offset[1],
+                )
+            )
+
+        last_element = self.elements[-1]
+        if isinstance(last_element, Station) and self.end_logo_offset is not None:
+            centers.append(
+                (
+                    last_element.position[0] + self.end_logo_offset[0],
+                    last_element.position[1] + self.end_logo_offset[1],
+                )
+            )
+        return centers
+
+    def get_logo_image(self, height):
+        if height not in self.logo_images:
+            logo_image = self.logo_image.clone()
+            logo_image.resize(round(
+                logo_image.width
+                / (logo_image.height / height)
+            ), height)
+            self.logo_images[height] = logo_image
+        return self.logo_images[height]
+
     def fix_stations_positions(self):
         cur_pos = self.start
         cur_direction = self.direction
@@ -264,18 +379,38 @@ class Line:
                 element.position = cur_pos
 
     def get_station(self, station_name):
-        for element in self.elements:
-            if isinstance(element, Station) and element.name == station_name:
-                return element
-        return None
+        return self.stations_by_name.get(station_name)
 
     @staticmethod
     def continue_line(coords, image, line_image, delta, direction):
-        line_part = line_image.clone()
-        line_part.resize(delta, line_part.height)
-        if direction in ["up", "down"]:
-            line_part.rotate(90)
-        place(image, line_part, coords, RelativeTo[opposite(direction.upper())])
+        if delta > 0:
+            vertical = direction in ["up", "down"]
+            relative_to = RelativeTo[opposite(direction.upper())]
+            line_color = None
+            if isinstance(image, ShapeBatch):
+                line_color = strip_cache.get(get_line_color, line_image)
+
+            if isinstance(line_image, ImageSize):
+                place(image, get_strip_size(line_image, delta, vertical), coords, relative_to)
+            elif line_color is not None:
+                left, top, width, height = get_place_bounds(
+                    get_strip_size(line_image, delta, vertical), coords, relative_to
+                )
+                image.add_shape(
+                    Shape(
+                        "rectangle",
+                        line_color,
+                        None,
+                        ((left, top), (left + width - 1, top + height - 1)),
+                    )
+                )
+            else:
+                place(
+                    image,
+                    strip_cache.get(get_line_strip, line_image, delta, vertical),
+                    coords,
+                    relative_to,
+                )
         return move(coords, delta, Direction[direction.upper()])
 
     @staticmethod
@@ -407,12 +542,19 @@ class Line:
     @staticmethod
     def draw_station_name(metro_map_image, station, font_path, highlight_color=None):
         if not station.hide_name:
-            if highlight_color is None:
-                text_image = get_text_image(station.name, metro_map_image, font_path)
+            if is_measuring(metro_map_image):
+                text_image = ImageSize(
+                    *get_text_size(
+                        station.name,
+                        font_path,
+                        Color("black") if highlight_color is None else Color("white"),
+                    )
+                )
+            elif highlight_color is None:
+                text_image = get_text_image(station.name, font_path)
             else:
                 text_image = get_text_image(
                     station.name,
-                    metro_map_image,
                     font_path,
                     Color("white"),
                     highlight_color,
@@ -428,40 +570,72 @@ class Line:
                 RelativeTo[station.name_relative_to.upper()],
             )
 
-    def draw_stations_names(self, metro_map_image, font_path, highlighted_station):
-        for element in self.elements:
-            if isinstance(element, Station):
-                highlight_color = None
-                if element == highlighted_station:
-                    highlight_color = self.line_image[0, 0]
-                Line.draw_station_name(
-                    metro_map_image, element, font_path, highlight_color
-                )
+    def draw_stations_names(
+            self, metro_map_image, font_path, highlighted_station, stations=None
+    ):
+        if stations is None:
+            stations = [
+                element for element in self.elements if isinstance(element, Station)
+            ]
+        for station in stations:
+            set_owner(metro_map_image, station.label_owner)
+            set_item(metro_map_image, ItemKind.LABEL, f"{self.name}: {station.name}")
+            highlight_color = None
+            if station == highlighted_station:
+                highlight_color = self.line_image[0, 0]
+            Line.draw_station_name(
+                metro_map_image, station, font_path, highlight_color
+            )
 
     def draw(self, metro_map_image):
-        position = self.start
-        direction = self.direction
+        self.draw_path(
+            metro_map_image,
+            self.elements,
+            [element.is_actually_planned() for element in self.elements],
+            self.start,
+            self.direction,
+        )
 
-        line_width = self.line_image.height
-        station_length = get_station(self.line_image, Orientation.UP).width
+    def draw_path(self, metro_map_image, elements, planned, position, direction):
+        line_image, planned_line_image = self.line_image, self.planned_line_image
+        # arcs are always measured on the cached glyph, their size is what
+        # ImageMagick's arc distortion makes of the line image
+        arc_image, planned_arc_image = line_image, planned_line_image
+        if is_measuring(metro_map_image):
+            line_image = get_image_size(line_image)
+            planned_line_image = get_image_size(planned_line_image)
+        batch = None
+        if draw_options["batch_segments"] and isinstance(metro_map_image, Image):
+            # segments of one opaque colour are filled in a single drawing
+            # pass over the image instead of one composite each
+            metro_map_image = batch = ShapeBatch(metro_map_image)
+
+        line_width = line_image.height
+        station_length = get_station(line_image, Orientation.UP).width
         transfer_length = get_transfer(
-            self.line_image, self.type, Orientation.RIGHT
+            line_image, self.type, Orientation.RIGHT
         ).width
-        turn_length = get_arc(self.line_image, TurnType.RIGHT_DOWN).width
+        turn_length = get_arc(arc_image, TurnType.RIGHT_DOWN).width
 
-        for num, element in enumerate(self.elements):
+        for num, element in enumerate(elements):
             element_image = (
-                self.planned_line_image
-                if element.is_actually_planned()
-                else self.line_image
+                planned_line_image
+                if planned[num]
+                else line_image
             )
+            if isinstance(element, (Station, StationPlacement)):
+                set_item(metro_map_image, ItemKind.STATION, f"{self.name}: {element.name}")
+            elif isinstance(element, Turn):
+                set_item(metro_map_image, ItemKind.ARC, f"{self.name}: turn {num}")
+            else:
+                set_item(metro_map_image, ItemKind.SEGMENT, f"{self.name}: segment {num}")
 
-            if isinstance(element, LineSegment):
+            if isinstance(element, (LineSegment, SegmentPlacement)):
                 line_length = element.length
 
                 if num != 0:
-                    prev_element = self.elements[num - 1]
-                    if isinstance(prev_element, Station):
+                    prev_element = elements[num - 1]
+                    if isinstance(prev_element, (Station, StationPlacement)):
                         line_length -= (
                             station_length // 2 + 1
                             if not prev_element.is_transfer()
@@ -470,9 +644,9 @@ class Line:
                     elif isinstance(prev_element, Turn):
                         line_length -= turn_length - line_width // 2
 
-                if num != len(self.elements) - 1:
-                    next_element = self.elements[num + 1]
-                    if isinstance(next_element, Station):
+                if num != len(elements) - 1:
+                    next_element = elements[num + 1]
+                    if isinstance(next_element, (Station, StationPlacement)):
                         line_length -= (
                             station_length // 2
                             if not next_element.is_transfer()
@@ -488,12 +662,12 @@ class Line:
                     position, metro_map_image, element_image, line_length, direction
                 )
 
-            if isinstance(element, Station):
+            if isinstance(element, (Station, StationPlacement)):
                 if num == 0:
                     position = self.continue_with_first_station(
                         metro_map_image, element, position, direction, element_image
                     )
-                elif num != len(self.elements) - 1:
+                elif num != len(elements) - 1:
                     position = self.continue_with_station(
                         metro_map_image, element, position, direction, element_image
                     )
@@ -504,39 +678,26 @@ class Line:
 
             if isinstance(element, Turn):
                 position, direction = self.continue_with_turn(
-                    metro_map_image, element, position, direction, element_image
-                )
-
-    def draw_logos(self, metro_map_image):
-        first_element = self.elements[0]
-        if isinstance(first_element, Station):
-            first_station_center = first_element.position
-            if self.start_logo_offset is not None:
-                place(
                     metro_map_image,
-                    self.logo_image_resized,
-                    [
-                        first_station_center[0] + self.start_logo_offset[0],
-                        first_station_center[1] + self.start_logo_offset[1],
-                    ],
-                    RelativeTo.CENTER,
+                    element,
+                    position,
+                    direction,
+                    planned_arc_image if planned[num] else arc_image,
                 )
 
-        last_element = self.elements[-1]
-        if isinstance(last_element, Station):
-            last_station_center = last_element.position
-            if self.end_logo_offset[0] is not None:
-                place(
-                    metro_map_image,
-                    self.logo_image_resized,
-                    [
-                        last_station_center[0] + self.end_logo_offset[0],
-                        last_station_center[1] + self.end_logo_offset[1],
-                    ],
-                    RelativeTo.CENTER,
-                )
+        if batch is not None:
+            batch.flush()
 
-    def get_linear_metro_map(self, reverse_direction, start_station_name=None):
+    def draw_logos(self, metro_map_image):
+        set_item(metro_map_image, ItemKind.LOGO, self.name)
+        if is_measuring(metro_map_image):
+            logo_image = ImageSize(*self.get_logo_size())
+        else:
+            logo_image = self.logo_image_resized
+        for center in self.get_logo_centers():
+            place(metro_map_image, logo_image, center, RelativeTo.CENTER)
+
+    def get_linear_layout(self, reverse_direction, start_station_name=None):
         start_station = self.get_station(start_station_name)
 
         elements = list(self.elements)
@@ -564,9 +725,7 @@ class Line:
                     break
 
         if len(stations) <= 1:
-            return self.map_data.no_boarding_image
-
-        temp_image = Image(width=100, height=100)
+            return None
 
         line_segments_length = []
         stations_orientation = []
@@ -585,9 +744,7 @@ class Line:
             ):
                 is_top = True
 
-            name_length = get_text_image(
-                station.name, temp_image, self.map_data.font_path
-            ).width
+            name_length = get_text_size(station.name, self.map_data.font_path)[0]
 
             transfer_lines = station.get_transfer_lines()
             transfers_length = max(0, 10 * (len(transfer_lines) - 1))
@@ -621,107 +778,159 @@ class Line:
 
         total_width = max(last_top, last_bottom)
 
-        direction_image = get_direction_image(
-            self.logo_image_resized, stations[len(stations) - 1].name, self.map_data.font_path
-        )
-        reverse_direction_image = None
+        direction_station = None
+        reverse_direction_station = None
         if not (
                 self.bidirectional
                 and start_station_name == stations[len(stations) - 1].name
         ):
-            total_width += direction_image.width
+            direction_station = stations[len(stations) - 1].name
+            total_width += get_direction_image_width(
+                self.logo_image_resized, direction_station, self.map_data.font_path
+            )
         else:
             total_width += 20
+        reverse_direction_width = 0
         if self.bidirectional and not start_station_name == stations[0].name:
-            reverse_direction_image = get_direction_image(
-                self.logo_image_resized, stations[0].name, self.map_data.font_path, True
+            reverse_direction_station = stations[0].name
+            reverse_direction_width = get_direction_image_width(
+                self.logo_image_resized, reverse_direction_station, self.map_data.font_path
             )
-            total_width += reverse_direction_image.width
-
-        linear_line = copy.copy(self)
-        linear_line.elements = list(self.elements)
-        linear_line.elements.clear()
+            total_width += reverse_direction_width
 
+        lead_length = None
         if not is_first_station:
             total_width += max(first_offset // 2, 50) - first_offset // 2
-            linear_line.elements.append(
-                LineSegment(linear_line, {"length": max(first_offset // 2 + 20, 50)})
-            )
+            lead_length = max(first_offset // 2 + 20, 50)
 
-        linear_line.start_logo_offset = None
-        linear_line.end_logo_offset = None
-        linear_line.direction = "left"
         if is_first_station:
-            linear_line.start = (total_width - 1 - 20 - first_offset // 2, 64)
+            start = (total_width - 1 - 20 - first_offset // 2, 64)
         else:
-            linear_line.start = (total_width - 1, 64)
+            start = (total_width - 1, 64)
+        start = (start[0] - reverse_direction_width, start[1])
+
+        path = []
+        if lead_length is not None:
+            path.append(SegmentPlacement(lead_length))
+
+        placements = []
+        highlighted_station = None
+        position = start
+        if lead_length is not None:
+            position = move(position, lead_length, Direction.LEFT)
+        for num, station in enumerate(stations):
+            if not station.is_transfer():
+                orientation = stations_orientation[num]
+                name_relative_to = opposite(orientation.upper()).lower()
+            else:
+                orientation = station.orientation
+                name_relative_to = "down"
+
+            placement = StationPlacement(
+                station,
+                position,
+                orientation,
+                name_relative_to,
+                (0, 20) if orientation == "down" else (0, -20),
+                False,
+            )
+            placements.append(placement)
+            if station == start_station:
+                highlighted_station = placement
+
+            path.append(placement)
+            if num != len(stations) - 1:
+                path.append(SegmentPlacement(line_segments_length[num]))
+                position = move(position, line_segments_length[num], Direction.LEFT)
+
+        # segments take their planned status from the rearranged path, while
+        # stations keep the status they have on the line itself
+        planned = get_planned_flags(
+            [
+                (element.station.is_planned, True)
+                if isinstance(element, StationPlacement)
+                else (None, False)
+                for element in path
+            ]
+        )
+        for num, element in enumerate(path):
+            if isinstance(element, StationPlacement):
+                planned[num] = element.station.is_actually_planned()
+
+        transfer_logos = []
+        for num, placement in enumerate(placements):
+            if placement.is_transfer():
+                cur_logo_pos = placement.position[0] - stations_transfers_length[num] // 2
+                for line in reversed(
+                        sorted(placement.station.get_transfer_lines(), key=cmp_to_key(Line.cmp))
+                ):
+                    transfer_logos.append(TransferLogoSlot(line, (cur_logo_pos, 100)))
+                    cur_logo_pos += line.logo_image_resized.width + 10
+
+        return LinearLayout(
+            total_width,
+            start,
+            tuple(path),
+            tuple(planned),
+            tuple(placements),
+            tuple(transfer_logos),
+            direction_station,
+            reverse_direction_station,
+            highlighted_station,
+        )
 
+    def draw_linear_layout(self, layout):
         linear_metro_map_image = Image(
-            width=total_width, height=128, background=Color("white")
+            width=layout.width, height=128, background=Color("white")
         )
         linear_metro_map_image.virtual_pixel = "transparent"
 
-        if not (
-                self.bidirectional
-                and start_station_name == stations[len(stations) - 1].name
-        ):
-            linear_metro_map_image.composite(direction_image)
-        if self.bidirectional and not start_station_name == stations[0].name:
+        if layout.direction_station is not None:
+            linear_metro_map_image.composite(
+                get_direction_image(
+                    self.logo_image_resized, layout.direction_station, self.map_data.font_path
+                )
+            )
+        if layout.reverse_direction_station is not None:
+            reverse_direction_image = get_direction_image(
+                self.logo_image_resized,
+                layout.reverse_direction_station,
+                self.map_data.font_path,
+                True,
+            )
             linear_metro_map_image.composite(
                 reverse_direction_image,
                 left=linear_metro_map_image.width - reverse_direction_image.width,
             )
-            linear_line.start = (
-                linear_line.start[0] - reverse_direction_image.width,
-                linear_line.start[1],
-            )
 
-        for num, station in enumerate(stations):
-            if not station.is_transfer():
-                station.orientation = stations_orientation[num]
-                station.name_relative_to = opposite(station.orientation.upper()).lower()
-            else:
-                station.name_relative_to = "down"
-
-            if station.orientation == "down":
-                station.name_offset = (0, 20)
-            else:
-                station.name_offset = (0, -20)
-
-            station.hide_name = False
-
-            linear_line.elements.append(station)
-            if num != len(stations) - 1:
-                linear_line.elements.append(
-                    LineSegment(linear_line, {"length": line_segments_length[num]})
-                )
-
-        linear_line.fix_stations_positions()
-
-        for num, station in enumerate(stations):
-            if station.is_transfer():
-                cur_logo_pos = station.position[0] - stations_transfers_length[num] // 2
-                for line in reversed(
-                        sorted(station.get_transfer_lines(), key=cmp_to_key(Line.cmp))
-                ):
-                    transfer_logo = line.logo_image_resized
-                    place(
-                        linear_metro_map_image,
-                        transfer_logo,
-                        (cur_logo_pos, 100),
-                        RelativeTo.LEFT,
-                    )
-                    cur_logo_pos += transfer_logo.width + 10
+        for transfer_logo in layout.transfer_logos:
+            place(
+                linear_metro_map_image,
+                transfer_logo.line.logo_image_resized,
+                transfer_logo.position,
+                RelativeTo.LEFT,
+            )
 
-        linear_line.draw(linear_metro_map_image)
-        linear_line.draw_stations_names(
-            linear_metro_map_image, self.map_data.font_path, start_station
+        self.draw_path(
+            linear_metro_map_image, layout.path, layout.planned, layout.start, "left"
+        )
+        self.draw_stations_names(
+            linear_metro_map_image,
+            self.map_data.font_path,
+            layout.highlighted_station,
+            layout.stations,
         )
 
         round_corners(linear_metro_map_image, 10)
 
         return complete_width(linear_metro_map_image)
 
+    def get_linear_metro_map(self, reverse_direction, start_station_name=None):
+        layout = self.get_linear_layout(reverse_direction, start_station_name)
+        if layout is None:
+            return self.map_data.no_boarding_image
+        return self.draw_linear_layout(layout)
+
 
 class Transfer:
     def __init__(self, map_data, transfer_json):
@@ -740,9 +949,14 @@ class Transfer:
                 )
             ),
         ]
+        self.transfer_json = transfer_json
         self.is_direct = transfer_json["is_direct"]
+        self.owner = "transfer:" + ":".join(
+            f"{station['line_name']}:{station['station_name']}"
+            for station in [transfer_json["station1"], transfer_json["station2"]]
+        )
 
-    def draw(self, metro_map_image):
+    def get_shapes(self):
         def add(point1, point2):
             return point1[0] + point2[0], point1[1] + point2[1]
 
@@ -771,31 +985,19 @@ class Transfer:
         coords2 = self.stations[1].position
         mid = mult(add(coords1, coords2), 0.5)
 
+        shapes = []
         if self.is_direct:
             moved_coords1 = move_point(coords1, mid, 10)
             moved_coords2 = move_point(coords2, mid, 10)
 
-            with Drawing() as draw:
-                draw.stroke_color = color1
-                draw.stroke_width = 9
-                draw.line(moved_coords1, mid)
-                draw(metro_map_image)
-
-            with Drawing() as draw:
-                draw.stroke_color = color2
-                draw.stroke_width = 9
-                draw.line(moved_coords2, mid)
-                draw(metro_map_image)
-
-            with Drawing() as draw:
-                draw.stroke_color = Color("white")
-                draw.stroke_width = 3
-                if mcd1:
-                    coords1 = move_point(coords1, mid, 7)
-                if mcd2:
-                    coords2 = move_point(coords2, mid, 7)
-                draw.line(coords1, coords2)
-                draw(metro_map_image)
+            shapes.append(Shape("line", color1, 9, (moved_coords1, mid)))
+            shapes.append(Shape("line", color2, 9, (moved_coords2, mid)))
+
+            if mcd1:
+                coords1 = move_point(coords1, mid, 7)
+            if mcd2:
+                coords2 = move_point(coords2, mid, 7)
+            shapes.append(Shape("line", Color("white"), 3, (coords1, coords2)))
         else:
             moved_coords1 = move_point(coords1, mid, 12.5 + mcd1)
             moved_coords2 = move_point(coords2, mid, 12.5 + mcd2)
@@ -810,37 +1012,72 @@ class Transfer:
             )
 
             for i in range(count - 1):
-                with Drawing() as draw:
-                    draw.stroke_color = Color("rgb(134, 164, 193)")
-                    draw.fill_color = draw.stroke_color
-                    draw.circle(cur_coord, add(cur_coord, (0.75, 0)))
-                    draw(metro_map_image)
-                    cur_coord = move_point(cur_coord, moved_coords2, step)
+                shapes.append(
+                    Shape(
+                        "circle",
+                        Color("rgb(134, 164, 193)"),
+                        None,
+                        (cur_coord, add(cur_coord, (0.75, 0))),
+                    )
+                )
+                cur_coord = move_point(cur_coord, moved_coords2, step)
+
+        return shapes
+
+    def draw(self, metro_map_image):
+        draw_shapes(metro_map_image, self.get_shapes())
+
+
+class TransferGraph:
+    # Reachable transfer stations and lines of every station, computed once
+    # with the reference traversal of Station.get_transfer_stations_rec.
+    def __init__(self, lines):
+        self.transfer_stations: Dict[Station, frozenset] = {}
+        self.transfer_lines: Dict[Station, frozenset] = {}
+
+        for line in lines:
+            for element in line.elements:
+                if isinstance(element, Station) and element.is_transfer():
+                    transfer_stations = frozenset(
+                        element.get_transfer_stations_reference()
+                    )
+                    self.transfer_stations[element] = transfer_stations
+                    self.transfer_lines[element] = frozenset(
+                        station.line for station in transfer_stations
+                    ) - {element.line}
+
+    def get_transfer_stations(self, station):
+        return self.transfer_stations.get(station, frozenset())
+
+    def get_transfer_lines(self, station):
+        return self.transfer_lines.get(station, frozenset())
+
+
+INFO_OWNER = "info"
+
+# filling segments as rectangles has not been compared pixel for pixel with
+# compositing their strips on ImageMagick yet, so it is only done on request
+draw_options = {"batch_segments": False}
 
 
 class MapData:
     def __init__(self, map_data_json: Dict[str, Any], assets_path):
+        self.map_data_json = map_data_json
         self.assets_path = assets_path
         self.image_resolution = tuple(map_data_json["image_resolution"])
-        self.info_image = Image(
-            filename=os.path.join(assets_path, "images", map_data_json["info_filename"])
-        )
         self.font_path = os.path.join(
             assets_path, "fonts", map_data_json["font_filename"]
         )
 
-        if "no_boarding_filename" in map_data_json:
-            self.no_boarding_image = Image(
-                filename=os.path.join(
-                    assets_path, "images", map_data_json["no_boarding_filename"]
-                )
-            )
-        else:
-            self.no_boarding_image = None
+        self.logo_strips = {}
 
         self.lines: List[Line] = []
+        self.lines_by_name: Dict[str, Line] = {}
         for line_json in map_data_json["lines"]:
-            self.lines.append(Line(self, line_json))
+            line = Line(self, line_json)
+            line.index = len(self.lines)
+            self.lines.append(line)
+            self.lines_by_name.setdefault(line.name, line)
 
         self.transfers: List[Transfer] = []
         if "transfers" in map_data_json:
@@ -851,74 +1088,154 @@ class MapData:
                 for station in cur_transfer.stations:
                     station.transfers.append(cur_transfer)
 
+        self.transfer_graph = TransferGraph(self.lines)
+
+    @cached_property
+    def info_image(self):
+        return load_image(
+            os.path.join(self.assets_path, "images", self.map_data_json["info_filename"])
+        )
+
+    @cached_property
+    def no_boarding_image(self):
+        if "no_boarding_filename" not in self.map_data_json:
+            return None
+        return load_image(
+            os.path.join(
+                self.assets_path, "images", self.map_data_json["no_boarding_filename"]
+            )
+        )
+
     def get_line(self, line_name: str):
-        for line in self.lines:
-            if line.name == line_name:
-                return line
-        return None
+        return self.lines_by_name.get(line_name)
+
+    def get_logo_strip(self, lines, height):
+        key = (tuple(lines), height)
+        if key not in self.logo_strips:
+            logos = [line.get_logo_image(height) for line in lines]
+            if len(logos) == 1:
+                self.logo_strips[key] = logos[0]
+                return logos[0]
+
+            lefts = [0]
+            right = logos[0].width
+            for i in range(1, len(lines)):
+                spacing = 16
+                if lines[i - 1].type == "mcd" and lines[i].type == "mcd":
+                    spacing = -10
+                right += spacing + logos[i].width
+                lefts.append(right - logos[i].width)
+
+            logo_strip = Image(width=right, height=logos[0].height)
+            logo_strip.composite(logos[0], left=0, top=0)
+            for logo, left in zip(logos[1:], lefts[1:]):
+                logo_strip.composite(
+                    logo, left=left, top=logo_strip.height // 2 - logo.height // 2
+                )
+            self.logo_strips[key] = logo_strip
+        return self.logo_strips[key]
 
     def get_station(self, station_full_name: tuple[str, str]):
         line = self.get_line(station_full_name[0])
         return line.get_station(station_full_name[1]) if line is not None else None
 
-    def get_max_text_length(self, metro_map_image):
+    def get_max_text_length(self):
         max_text_length = 0
         for line in self.lines:
             if line.name is not None:
                 max_text_length = max(
                     max_text_length,
-                    get_text_image(line.name, metro_map_image, self.font_path).width,
+                    get_text_size(line.name, self.font_path)[0],
                 )
         return max_text_length
 
-    def draw_lines_info(self, metro_map_image):
-        lines_image = Image(
-            width=400 + self.get_max_text_length(metro_map_image),
-            height=len(self.lines) * 33,
+    def get_lines_info_bounds(self):
+        width = 400 + self.get_max_text_length()
+        height = len(self.lines) * 33
+        return 25, self.image_resolution[0] - height - 20, width, height
+
+    def get_info_bounds(self):
+        return (
+            self.image_resolution[1] - self.info_image.width,
+            self.image_resolution[0] - self.info_image.height,
+            self.info_image.width,
+            self.info_image.height,
         )
+
+    def draw_lines_info(self, metro_map_image):
+        left, top, width, height = self.get_lines_info_bounds()
+        if is_measuring(metro_map_image):
+            metro_map_image.composite(ImageSize(width, height), left=left, top=top)
+            return
+
+        lines_image = Image(width=width, height=height)
         cur_top = 0
         for line in self.lines:
             place(lines_image, line.logo_image_resized, [30, cur_top + 20], RelativeTo.CENTER)
 
-            line.line_image.resize(width=100)
-            place(lines_image, line.line_image, [70, cur_top + 20], RelativeTo.LEFT)
+            line_image = line.line_image.clone()
+            line_image.resize(width=100)
+            place(lines_image, line_image, [70, cur_top + 20], RelativeTo.LEFT)
 
             place(
                 lines_image,
-                get_text_image(line.name, metro_map_image, self.font_path),
+                get_text_image(line.name, self.font_path),
                 [190, cur_top + 20],
                 RelativeTo.LEFT,
             )
 
             cur_top += 33
 
-        metro_map_image.composite(
-            lines_image, left=25, top=metro_map_image.height - lines_image.height - 20
-        )
+        metro_map_image.composite(lines_image, left=left, top=top)
 
     def draw_info(self, metro_map_image):
-        metro_map_image.composite(
-            self.info_image,
-            left=metro_map_image.width - self.info_image.width,
-            top=metro_map_image.height - self.info_image.height,
+        left, top, width, height = self.get_info_bounds()
+        if is_measuring(metro_map_image):
+            metro_map_image.composite(ImageSize(width, height), left=left, top=top)
+            return
+        metro_map_image.composite(self.info_image, left=left, top=top)
+
+    def get_display_list(self, highlighted_station=None, cell_size=512):
+        display_list = DisplayList(
+            self.image_resolution[1], self.image_resolution[0], cell_size
         )
-
-    def draw(self, highlighted_station=None):
-        metro_map_image = Image(
-            height=self.image_resolution[0],
-            width=self.image_resolution[1],
-            background=Color("white"),
+        self.draw_map(display_list, highlighted_station)
+        return display_list
+
+    def get_geometry(self, cell_size=512, highlighted_station=None):
+        # bounds of every map item from glyph and text sizes, the same
+        # drawing code runs on a measuring display list without rasterizing
+        display_list = DisplayList(
+            self.image_resolution[1], self.image_resolution[0], cell_size, True
         )
+        self.draw_map(display_list, highlighted_station)
+        return display_list.geometry
+
+    def draw_map(self, metro_map_image, highlighted_station=None):
         for line in sorted(self.lines, key=cmp_to_key(Line.cmp)):
+            set_owner(metro_map_image, line.owner)
             line.draw(metro_map_image)
         for line in self.lines:
+            set_owner(metro_map_image, line.owner)
             line.draw_logos(metro_map_image)
+        transfer_shapes = []
         for transfer in self.transfers:
-            transfer.draw(metro_map_image)
+            set_owner(metro_map_image, transfer.owner)
+            set_item(metro_map_image, ItemKind.TRANSFER, transfer.owner)
+            if isinstance(metro_map_image, DisplayList):
+                transfer.draw(metro_map_image)
+            else:
+                transfer_shapes.extend(transfer.get_shapes())
+        # the connectors of all transfers are drawn in a single pass
+        draw_shapes(metro_map_image, transfer_shapes)
         for line in self.lines:
             line.draw_stations_names(
                 metro_map_image, self.font_path, highlighted_station
             )
+        set_owner(metro_map_image, INFO_OWNER)
+        set_item(metro_map_image, ItemKind.INFO, "lines")
         self.draw_lines_info(metro_map_image)
+        set_item(metro_map_image, ItemKind.INFO, "info")
         self.draw_info(metro_map_image)
-        return metro_map_image
+        set_owner(metro_map_image, None)
+        set_item(metro_map_image, None, None)
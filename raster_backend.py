@@ -0,0 +1,136 @@
+import numpy
+from wand.color import Color
+from wand.image import Image
+
+from utilities import draw_shapes, get_union
+
+
+class WandCanvas:
+    # Draws straight onto an ImageMagick image, one composite call per
+    # recorded operation
+    def __init__(self, width, height, background=Color("white")):
+        self.image = Image(width=width, height=height, background=background)
+
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+    def composite(self, image, left=0, top=0):
+        self.image.composite(image, left=left, top=top)
+
+    def draw_shapes(self, shapes, origin=(0, 0)):
+        draw_shapes(self.image, shapes, origin)
+
+    def get_image(self):
+        return self.image
+
+
+MAX_VALUE = numpy.iinfo(numpy.uint16).max
+
+
+class NumpyCanvas:
+    # Keeps the canvas as one 16-bit RGBA array and blends sources into it
+    # with array slicing, only the blended region is converted to floats.
+    # 8-bit pixels would be rounded after every blend and drift by more than
+    # one step where semi-transparent edges stack, 16 bits like ImageMagick's
+    # Q16 stay well within it at half the memory of floats. Every distinct
+    # source image is exported once
+    def __init__(self, width, height, background=Color("white")):
+        self.width = width
+        self.height = height
+        self.pixels = numpy.empty((height, width, 4), dtype=numpy.uint16)
+        self.pixels[:] = [
+            round(channel * MAX_VALUE)
+            for channel in [background.red, background.green, background.blue, background.alpha]
+        ]
+        self.sources = {}
+
+    def get_source(self, image):
+        source = self.sources.get(id(image))
+        if source is None:
+            pixels = numpy.array(
+                image.export_pixels(channel_map="RGBA", storage="float"),
+                dtype=numpy.float32,
+            ).reshape(image.height, image.width, 4)
+            # the image is kept with its pixels so its id is not reused
+            source = self.sources[id(image)] = (image, pixels, bool((pixels[..., 3] >= 1).all()))
+        return source[1:]
+
+    def blend(self, pixels, left, top, is_opaque=False):
+        height, width = pixels.shape[:2]
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(left + width, self.width), min(top + height, self.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        source = pixels[y0 - top: y1 - top, x0 - left: x1 - left]
+        target = self.pixels[y0:y1, x0:x1]
+        if is_opaque:
+            target[:] = numpy.rint(source * MAX_VALUE)
+            return
+
+        blended = target / numpy.float32(MAX_VALUE)
+        source_alpha = source[..., 3:]
+        target_alpha = blended[..., 3:] * (1 - source_alpha)
+        alpha = source_alpha + target_alpha
+        numpy.divide(
+            source[..., :3] * source_alpha + blended[..., :3] * target_alpha,
+            alpha,
+            out=blended[..., :3],
+            where=alpha > 0,
+        )
+        blended[..., 3:] = alpha
+        target[:] = numpy.rint(blended * MAX_VALUE)
+
+    def composite(self, image, left=0, top=0):
+        pixels, is_opaque = self.get_source(image)
+        self.blend(pixels, left, top, is_opaque)
+
+    def draw_shapes(self, shapes, origin=(0, 0)):
+        # shapes are drawn by ImageMagick onto a transparent patch covering
+        # them, which is then blended like any other source
+        if not shapes:
+            return
+        bounds = shapes[0].get_bounds()
+        for shape in shapes[1:]:
+            bounds = get_union(bounds, shape.get_bounds())
+        left, top = bounds[0] - origin[0], bounds[1] - origin[1]
+        with Image(width=bounds[2], height=bounds[3], background=Color("transparent")) as patch:
+            draw_shapes(patch, shapes, bounds[:2])
+            pixels = numpy.array(
+                patch.export_pixels(channel_map="RGBA", storage="float"),
+                dtype=numpy.float32,
+            ).reshape(patch.height, patch.width, 4)
+        self.blend(pixels, left, top)
+
+    def get_image(self):
+        return Image.from_array(self.pixels, channel_map="RGBA", storage="short")
+
+
+BACKENDS = {"wand": WandCanvas, "numpy": NumpyCanvas}
+
+
+# the one way a full map is rasterized: glyphs and texts are made by
+# ImageMagick for both backends, a backend only composites the recorded map
+def draw_map(map_data, backend="wand", highlighted_station=None):
+    display_list = map_data.get_display_list(highlighted_station)
+    canvas = BACKENDS[backend](display_list.width, display_list.height)
+    display_list.replay(canvas)
+    return canvas.get_image()
+
+
+def get_pixel_difference(image1, image2):
+    if image1.size != image2.size:
+        raise ValueError(f"Image sizes differ: {image1.size} and {image2.size}")
+    pixels = [
+        numpy.array(
+            image.export_pixels(channel_map="RGBA", storage="float"), dtype=numpy.float32
+        )
+        for image in [image1, image2]
+    ]
+    difference = numpy.abs(pixels[0] - pixels[1])
+    return float(difference.max()), float(difference.mean())
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import os
+import threading
+
+import numpy
+from wand.image import Image
+from wand.version import MAGICK_VERSION
+
+RASTER_CACHE_VERSION = 1
+
+
+def get_raster_key(*parts):
+    data = repr((RASTER_CACHE_VERSION, MAGICK_VERSION, *parts))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, path, max_size=256 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self.entries = {}
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                self.entries[entry.name] = (stat.st_size, stat.st_mtime)
+
+    def get_size(self):
+        return sum(size for size, _ in self.entries.values())
+
+    def load(self, key):
+        filename = key + ".npy"
+        path = os.path.join(self.path, filename)
+        try:
+            pixels = numpy.load(path)
+            os.utime(path)
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return None
+
+        # sizes are file sizes everywhere, so the budget matches the folder
+        with self.lock:
+            self.entries[filename] = (stat.st_size, stat.st_mtime)
+        return Image.from_array(pixels, channel_map="RGBA", storage="double")
+
+    def store(self, key, image):
+        filename = key + ".npy"
+        path = os.path.join(self.path, filename)
+        pixels = numpy.array(
+            image.export_pixels(channel_map="RGBA", storage="double")
+        ).reshape(image.height, image.width, 4)
+
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as file:
+                numpy.save(file, pixels)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write raster cache entry {path}: {e}")
+            return
+
+        with self.lock:
+            self.entries[filename] = (os.path.getsize(path), os.path.getmtime(path))
+            self.evict()
+
+    def evict(self):
+        total_size = self.get_size()
+        if total_size <= self.max_size:
+            return
+        for filename, (size, _) in sorted(
+                self.entries.items(), key=lambda entry: entry[1][1]
+        ):
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+            del self.entries[filename]
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+    def get(self, key, render):
+        image = self.load(key)
+        if image is not None:
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        image = render()
+        self.store(key, image)
+        return image
+
+    def clear(self):
+        with self.lock:
+            for filename in list(self.entries):
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except OSError:
+                    pass
+            self.entries.clear()
+
+
+disk_cache = None
+
+
+def set_disk_cache(path, max_size):
+    global disk_cache
+
+    disk_cache = DiskCache(path, max_size) if path is not None else None
+
+
+def get_cached_raster(key_parts, render):
+    if disk_cache is None:
+        return render()
+    return disk_cache.get(get_raster_key(*key_parts), render)
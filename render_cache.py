@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+
+from map_data import Station, draw_options
+from utilities import get_file_hash
+
+RENDER_CACHE_VERSION = 1
+
+LINE_ASSET_KEYS = ("line_filename", "planned_line_filename", "logo_filename")
+
+
+def get_key(*parts):
+    data = json.dumps(
+        [RENDER_CACHE_VERSION, *parts], sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def get_line_style(line):
+    style = {
+        key: value for key, value in line.line_json.items() if key != "elements"
+    }
+    for asset_key in LINE_ASSET_KEYS:
+        if asset_key in line.line_json:
+            style[asset_key] = get_file_hash(
+                os.path.join(line.map_data.assets_path, "images", line.line_json[asset_key])
+            )
+    return style
+
+
+def get_map_assets(map_data):
+    assets = {"font": get_file_hash(map_data.font_path)}
+    if "no_boarding_filename" in map_data.map_data_json:
+        assets["no_boarding"] = get_file_hash(
+            os.path.join(
+                map_data.assets_path,
+                "images",
+                map_data.map_data_json["no_boarding_filename"],
+            )
+        )
+    return assets
+
+
+def get_station_transfers(station):
+    return {
+        "is_transfer": station.is_transfer(),
+        "lines": sorted(
+            (line.name, line.priority) for line in station.get_transfer_lines()
+        ),
+    }
+
+
+@lru_cache(maxsize=None)
+def get_linear_line_key(line):
+    transfers = []
+    transfer_lines = set()
+    for element in line.elements:
+        if isinstance(element, Station):
+            transfers.append(get_station_transfers(element))
+            transfer_lines.update(element.get_transfer_lines())
+
+    return get_key(
+        "linear",
+        line.line_json,
+        get_line_style(line),
+        transfers,
+        sorted(
+            (get_line_style(transfer_line) for transfer_line in transfer_lines),
+            key=lambda style: style.get("name"),
+        ),
+        get_map_assets(line.map_data),
+    )
+
+
+def get_linear_map_key(line, station_name, reverse_direction):
+    return get_key(
+        get_linear_line_key(line), station_name, reverse_direction, draw_options["batch_segments"]
+    )
+
+
+def get_station_sign_key(station, width, height, transfer_rendering):
+    lines = [station.line]
+    if transfer_rendering:
+        lines.extend(station.get_transfer_lines())
+        lines.sort(key=lambda l: l.index)
+
+    return get_key(
+        "sign",
+        station.name,
+        [get_line_style(line) for line in lines],
+        get_map_assets(station.line.map_data),
+        width,
+        height,
+        transfer_rendering,
+    )
+
+
+class RenderCache:
+    def __init__(self, output_path, enabled=True):
+        output_path = os.path.normpath(os.path.abspath(output_path))
+        self.manifest_path = output_path + ".manifest.json"
+        self.enabled = enabled
+        self.entries = {}
+
+        # --force only bypasses is_fresh, entries of other commands sharing
+        # the output folder must survive the save
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, encoding="utf-8") as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError):
+                logging.warning(f"Ignoring unreadable manifest {self.manifest_path}")
+
+    def is_fresh(self, filename, key):
+        return (
+            self.enabled
+            and self.entries.get(os.path.basename(filename)) == key
+            and os.path.exists(filename)
+        )
+
+    def update(self, filename, key):
+        self.entries[os.path.basename(filename)] = key
+
+    def discard(self, filename):
+        self.entries.pop(os.path.basename(filename), None)
+
+    def save(self):
+        with open(self.manifest_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,136 @@
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import image_writer
+import raster_cache
+from draw_elements import glyph_cache
+from image_writer import WriteError, create_writer, output_stats
+from map_data import MapData, draw_options
+
+_map_data = None
+_writer = None
+_finish_barrier = None
+
+
+def get_cache_options():
+    disk_cache = raster_cache.disk_cache
+    if disk_cache is None:
+        return glyph_cache.maxsize, None, None
+    return glyph_cache.maxsize, disk_cache.path, disk_cache.max_size
+
+
+def init_worker(
+        map_data_text, assets_path, log_level, writer_options, map_draw_options, cache_options, finish_barrier
+):
+    global _map_data, _writer, _finish_barrier
+
+    logging.getLogger().setLevel(log_level)
+    # workers do not inherit the settings of the parent under spawn or forkserver
+    glyph_cache.maxsize, cache_dir, cache_size = cache_options
+    raster_cache.set_disk_cache(cache_dir, cache_size)
+    _map_data = MapData(json.loads(map_data_text), assets_path)
+    image_writer.writer_options.update(writer_options)
+    draw_options.update(map_draw_options)
+    _writer = create_writer()
+    _finish_barrier = finish_barrier
+
+
+def finish_worker(_):
+    # drains the writer of the worker and hands its timings and files back,
+    # the barrier keeps a worker from taking a second one of these calls
+    # before every other worker has taken its own
+    error = None
+    try:
+        _writer.close()
+    except Exception as e:
+        error = str(e)
+    _finish_barrier.wait()
+    return _writer.stats, _writer.written, error
+
+
+def use_map_data(map_data, writer):
+    global _map_data, _writer
+
+    _map_data = map_data
+    _writer = writer
+
+
+def render_linear_map(job):
+    line_name, station_name, reverse_direction, filename = job
+
+    start_time = time.perf_counter()
+    line = _map_data.get_line(line_name)
+    linear_metro_map = line.get_linear_metro_map(reverse_direction, station_name)
+    if linear_metro_map is _map_data.no_boarding_image:
+        linear_metro_map = linear_metro_map.clone()
+    render_time = time.perf_counter() - start_time
+
+    _writer.submit(linear_metro_map, [filename])
+    return filename, render_time
+
+
+def render_station_sign(job):
+    line_name, station_name, transfers, outputs = job
+
+    start_time = time.perf_counter()
+    station = _map_data.get_line(line_name).get_station(station_name)
+    sign_images = station.get_sign_images(
+        [(width, height) for width, height, _ in outputs], transfers
+    )
+    render_time = time.perf_counter() - start_time
+
+    for sign_image, (_, _, filenames) in zip(sign_images, outputs):
+        _writer.submit(sign_image, filenames)
+    return outputs[0][2][0], render_time
+
+
+def run_jobs(job_function, jobs, map_data, map_data_text, assets_path, jobs_count):
+    # returns the files that were written, a failed write raises a
+    # WriteError listing them once all other writes are done
+    if jobs_count <= 1:
+        use_map_data(map_data, create_writer())
+        try:
+            for i, job in enumerate(jobs):
+                filename, render_time = job_function(job)
+                output_stats.render_time += render_time
+                logging.info(f"[{i + 1} / {len(jobs)}] Rendered {filename}")
+        finally:
+            try:
+                output_stats.add(_writer.close())
+            except Exception as e:
+                raise WriteError(f"Could not write images: {e}", set(_writer.written)) from e
+        return set(_writer.written)
+
+    finish_barrier = multiprocessing.Barrier(jobs_count)
+    with ProcessPoolExecutor(
+            max_workers=jobs_count,
+            initializer=init_worker,
+            initargs=(
+                map_data_text,
+                assets_path,
+                logging.getLogger().level,
+                image_writer.writer_options,
+                draw_options,
+                get_cache_options(),
+                finish_barrier,
+            ),
+    ) as executor:
+        for i, (filename, render_time) in enumerate(executor.map(job_function, jobs)):
+            output_stats.render_time += render_time
+            logging.info(f"[{i + 1} / {len(jobs)}] Rendered {filename}")
+        # the writers are drained while the pool still runs, one call per worker
+        finished = list(executor.map(finish_worker, range(jobs_count)))
+
+    written = set()
+    errors = []
+    for stats, worker_written, error in finished:
+        output_stats.add(stats)
+        written.update(worker_written)
+        if error is not None:
+            errors.append(error)
+    if errors:
+        raise WriteError(f"Could not write images: {'; '.join(errors)}", written)
+    return written
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from map_data import MapData
+from image_writer import writer_options
+from raster_backend import draw_map
+from utilities import clear_asset_caches, get_image_blob
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def get_flag(query, name):
+    return query.get(name, "0").lower() in ["1", "true", "yes"]
+
+
+def get_int(query, name, default):
+    try:
+        return int(query.get(name, default))
+    except ValueError:
+        raise RequestError(400, f"{name} must be an integer")
+
+
+class RenderServer:
+    def __init__(self, map_data_path, assets_path, jobs_count, max_pending, reload_interval=1.0):
+        self.map_data_path = map_data_path
+        self.assets_path = assets_path
+        self.max_pending = max_pending
+        self.reload_interval = reload_interval
+        self.executor = ThreadPoolExecutor(max_workers=jobs_count)
+
+        # identical requests arriving while a render is running wait for the
+        # same future, the key includes the map generation so a reload never
+        # serves an image of the old map to new requests
+        self.in_flight = {}
+        self.renders = 0
+        self.coalesced = 0
+
+        self.map_data, self.map_data_mtime = self.load_map_data()
+        self.generation = 0
+
+    def load_map_data(self, reload=False):
+        if reload:
+            clear_asset_caches()
+        mtime = os.stat(self.map_data_path).st_mtime_ns
+        with open(self.map_data_path, encoding="utf-8") as file:
+            map_data = MapData(json.load(file), self.assets_path)
+        return map_data, mtime
+
+    async def watch_map_data(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                mtime = os.stat(self.map_data_path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime == self.map_data_mtime:
+                continue
+
+            try:
+                map_data, mtime = await loop.run_in_executor(
+                    self.executor, self.load_map_data, True
+                )
+            except Exception as e:
+                # a half written file fails to parse, it is retried on its next change
+                logging.error(f"Could not reload {self.map_data_path}: {e}")
+                self.map_data_mtime = mtime
+                continue
+
+            self.map_data, self.map_data_mtime = map_data, mtime
+            self.generation += 1
+            logging.info(f"Reloaded {self.map_data_path} as generation {self.generation}")
+
+    def get_station(self, map_data, query, required):
+        line_name = query.get("line")
+        station_name = query.get("station")
+        if line_name is None and station_name is None and not required:
+            return None, None
+        if line_name is None or station_name is None:
+            raise RequestError(400, "line and station must be given")
+
+        line = map_data.get_line(line_name)
+        if line is None:
+            raise RequestError(404, f"Unknown line {line_name}")
+        if line.get_station(station_name) is None:
+            raise RequestError(404, f"Unknown station {station_name} of {line_name}")
+        return line_name, station_name
+
+    def get_params(self, map_data, kind, query):
+        if kind == "full":
+            return self.get_station(map_data, query, False)
+        if kind == "linear":
+            line_name = query.get("line")
+            if map_data.get_line(line_name) is None:
+                raise RequestError(404, f"Unknown line {line_name}")
+            station_name = query.get("station")
+            if station_name is not None:
+                self.get_station(map_data, query, True)
+            return line_name, station_name, get_flag(query, "reverse")
+        if kind == "sign":
+            width = get_int(query, "width", 3 * 128)
+            height = get_int(query, "height", 128)
+            if not (16 < width <= 4096 and 16 < height <= 4096):
+                raise RequestError(400, "Sign size must be between 17 and 4096 pixels")
+            return (
+                *self.get_station(map_data, query, True),
+                width,
+                height,
+                get_flag(query, "transfers"),
+            )
+        raise RequestError(404, f"Unknown image kind {kind}")
+
+    @staticmethod
+    def render(map_data, kind, params):
+        if kind == "full":
+            image = draw_map(map_data, "wand", map_data.get_station(params) if params[0] else None)
+        elif kind == "linear":
+            line_name, station_name, reverse_direction = params
+            image = map_data.get_line(line_name).get_linear_metro_map(
+                reverse_direction, station_name
+            )
+            if image is None:
+                raise RequestError(404, f"No boarding at {station_name} of {line_name}")
+            if image is map_data.no_boarding_image:
+                # encoding sets options on the image, the shared asset is
+                # also encoded by other requests at the same time
+                image = image.clone()
+        else:
+            line_name, station_name, width, height, transfers = params
+            station = map_data.get_station((line_name, station_name))
+            image = station.get_sign_image(width, height, transfers)
+        with image:
+            return get_image_blob(
+                image, "png", writer_options["compression_level"], writer_options["png_filter"]
+            )
+
+    async def get_image(self, kind, query):
+        map_data = self.map_data
+        params = self.get_params(map_data, kind, query)
+        key = (self.generation, kind, params)
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            if len(self.in_flight) >= self.max_pending:
+                raise RequestError(503, "Too many renders pending")
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, self.render, map_data, kind, params
+            )
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            self.renders += 1
+
+        # a client going away must not cancel a render other clients wait for
+        return await asyncio.shield(future)
+
+    def get_status(self):
+        return {
+            "map_data": os.path.abspath(self.map_data_path),
+            "generation": self.generation,
+            "renders": self.renders,
+            "coalesced": self.coalesced,
+            "pending": len(self.in_flight),
+        }
+
+    async def handle(self, reader, writer):
+        status, content_type, body = 200, "image/png", b""
+        request_line = []
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass
+            if len(request_line) != 3:
+                raise RequestError(400, "Malformed request")
+            method, target, _ = request_line
+            if method != "GET":
+                raise RequestError(405, f"Method {method} is not allowed")
+
+            url = urlsplit(target)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            kind = url.path.strip("/")
+            if kind == "status":
+                content_type = "application/json"
+                body = json.dumps(self.get_status()).encode("utf-8")
+            else:
+                body = await self.get_image(kind, query)
+        except RequestError as e:
+            status, content_type, body = e.status, "text/plain", str(e).encode("utf-8")
+        except Exception as e:
+            logging.exception(f"Render failed: {e}")
+            status, content_type, body = 500, "text/plain", b"Render failed"
+
+        logging.debug(f"{status} {' '.join(request_line[:2])}")
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def serve(self, host=None, port=None, socket_path=None):
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            print(f"Serving {self.map_data_path} on {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"Serving {self.map_data_path} on http://{host}:{port}")
+
+        watcher = asyncio.create_task(self.watch_map_data())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.executor.shutdown(wait=True, cancel_futures=True)
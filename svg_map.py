@@ -0,0 +1,288 @@
+import base64
+import mimetypes
+import os
+from functools import cmp_to_key
+from xml.sax.saxutils import escape, quoteattr
+
+from map_data import Line, LineSegment, Station, Turn
+from utilities import Direction, RelativeTo, get_place_bounds, get_text_size, move
+
+LABEL_FONT_SIZE = 18
+LABEL_BACKGROUND = "rgba(255,255,255,0.5)"
+
+
+def get_css_color(color):
+    return f"#{color.red_int8:02x}{color.green_int8:02x}{color.blue_int8:02x}"
+
+
+def get_color(image):
+    return get_css_color(image[0, 0])
+
+
+def get_vector(direction):
+    return move((0, 0), 1, Direction[direction.upper()])
+
+
+def get_data_uri(path):
+    mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as file:
+        return f"data:{mime_type};base64,{base64.b64encode(file.read()).decode('ascii')}"
+
+
+class SvgWriter:
+    def __init__(self, width, height, font_path):
+        self.width = width
+        self.height = height
+        self.font_path = font_path
+        self.elements = []
+        self.data_uris = {}
+
+    @staticmethod
+    def get_element(tag, attributes, content=None):
+        attributes = " ".join(
+            f"{key.rstrip('_').replace('_', '-')}={quoteattr(str(value))}"
+            for key, value in attributes.items()
+        )
+        if content is None:
+            return f"<{tag} {attributes}/>"
+        return f"<{tag} {attributes}>{content}</{tag}>"
+
+    def add(self, tag, **attributes):
+        text = attributes.pop("text", None)
+        self.elements.append(
+            self.get_element(tag, attributes, None if text is None else escape(text))
+        )
+
+    def add_image(self, path, bounds):
+        if path not in self.data_uris:
+            self.data_uris[path] = get_data_uri(path)
+        left, top, width, height = bounds
+        self.add(
+            "image",
+            href=self.data_uris[path],
+            x=left,
+            y=top,
+            width=width,
+            height=height,
+            preserveAspectRatio="none",
+        )
+
+    def add_text(self, text, bounds, font_size=LABEL_FONT_SIZE, color="black", background=None):
+        left, top, width, height = bounds
+        if background is not None:
+            self.add("rect", x=left, y=top, width=width, height=height, fill=background)
+        # same baseline as render_text_image, SVG text does not break lines
+        # so every line gets its own tspan spaced like the multiline metrics
+        lines = text.split("\n")
+        line_height = height / len(lines)
+        tspans = "".join(
+            self.get_element("tspan", {"x": left, "dy": line_height if num else 0}, escape(line))
+            for num, line in enumerate(lines)
+        )
+        self.elements.append(
+            self.get_element(
+                "text",
+                {"x": left, "y": top + font_size - 4, "font_size": font_size, "fill": color},
+                tspans,
+            )
+        )
+
+    def write(self, file):
+        file.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" '
+            f'height="{self.height}" viewBox="0 0 {self.width} {self.height}">\n'
+            "<defs>\n<style>\n"
+            f'@font-face {{ font-family: map-font; src: url("{get_data_uri(self.font_path)}"); }}\n'
+            "text { font-family: map-font; white-space: pre; }\n"
+            "</style>\n</defs>\n"
+        )
+        file.write(f'<rect width="{self.width}" height="{self.height}" fill="white"/>\n')
+        for element in self.elements:
+            file.write(element + "\n")
+        file.write("</svg>\n")
+
+
+def draw_line_path(svg, line):
+    # the path follows the same cursor as Line.__init__, turns are rounded
+    # with about the radius of the arc glyph
+    line_width = line.line_image.height
+    radius = 3 * line_width
+    colors = [get_color(line.line_image)]
+    if line.planned_line_image is not None:
+        colors.append(get_color(line.planned_line_image))
+
+    def add_stroke(path, planned):
+        svg.add(
+            "path",
+            d=path,
+            fill="none",
+            stroke=colors[planned and len(colors) > 1],
+            stroke_width=line_width,
+            stroke_dasharray=f"{2 * line_width} {line_width}" if planned else "none",
+        )
+
+    elements = line.elements
+    position = tuple(line.start)
+    direction = line.direction
+    stations = []
+    for num, element in enumerate(elements):
+        planned = element.is_actually_planned()
+        if isinstance(element, Station):
+            stations.append((element, num in [0, len(elements) - 1], direction))
+        if isinstance(element, LineSegment):
+            vector = get_vector(direction)
+            start = position
+            end = move(position, element.length, Direction[direction.upper()])
+            if num > 0 and isinstance(elements[num - 1], Turn):
+                start = (start[0] + vector[0] * radius, start[1] + vector[1] * radius)
+            if num < len(elements) - 1 and isinstance(elements[num + 1], Turn):
+                end = (end[0] - vector[0] * radius, end[1] - vector[1] * radius)
+            add_stroke(f"M {start[0]} {start[1]} L {end[0]} {end[1]}", planned)
+            position = move(position, element.length, Direction[direction.upper()])
+        elif isinstance(element, Turn):
+            vector1 = get_vector(direction)
+            vector2 = get_vector(element.direction)
+            start = (position[0] - vector1[0] * radius, position[1] - vector1[1] * radius)
+            end = (position[0] + vector2[0] * radius, position[1] + vector2[1] * radius)
+            sweep = int(vector1[0] * vector2[1] - vector1[1] * vector2[0] > 0)
+            add_stroke(
+                f"M {start[0]} {start[1]} A {radius} {radius} 0 0 {sweep} {end[0]} {end[1]}",
+                planned,
+            )
+            direction = element.direction
+
+    for station, is_end, direction in stations:
+        draw_station(svg, station, is_end, direction, colors, line_width)
+
+
+def draw_station(svg, station, is_end, direction, colors, line_width):
+    color = colors[station.is_actually_planned() and len(colors) > 1]
+    x, y = station.position
+    if station.is_transfer():
+        ring_radius = 13 - line_width / 2
+        svg.add(
+            "circle",
+            cx=x,
+            cy=y,
+            r=ring_radius,
+            fill="white",
+            stroke=color,
+            stroke_width=line_width,
+        )
+    elif is_end:
+        width, height = line_width, 3 * line_width
+        if direction in ["up", "down"]:
+            width, height = height, width
+        svg.add(
+            "rect",
+            x=x - width / 2,
+            y=y - height / 2,
+            width=width,
+            height=height,
+            fill=color,
+        )
+    else:
+        vector = get_vector(station.orientation)
+        svg.add(
+            "line",
+            x1=x,
+            y1=y,
+            x2=x + vector[0] * line_width,
+            y2=y + vector[1] * line_width,
+            stroke=color,
+            stroke_width=line_width,
+        )
+
+
+def draw_logos(svg, line):
+    width, height = line.get_logo_size()
+    path = os.path.join(line.map_data.assets_path, "images", line.line_json["logo_filename"])
+    for center in line.get_logo_centers():
+        svg.add_image(path, get_place_bounds((width, height), center, RelativeTo.CENTER))
+
+
+def draw_transfers(svg, map_data):
+    for transfer in map_data.transfers:
+        for shape in transfer.get_shapes():
+            if shape.kind == "circle":
+                center, perimeter = shape.points
+                radius = ((perimeter[0] - center[0]) ** 2 + (perimeter[1] - center[1]) ** 2) ** 0.5
+                svg.add(
+                    "circle",
+                    cx=center[0],
+                    cy=center[1],
+                    r=radius,
+                    fill=get_css_color(shape.color),
+                    stroke=get_css_color(shape.color),
+                    stroke_width=shape.stroke_width or 1,
+                )
+            else:
+                (x1, y1), (x2, y2) = shape.points
+                svg.add(
+                    "line",
+                    x1=x1,
+                    y1=y1,
+                    x2=x2,
+                    y2=y2,
+                    stroke=get_css_color(shape.color),
+                    stroke_width=shape.stroke_width or 1,
+                )
+
+
+def draw_labels(svg, map_data):
+    for line in map_data.lines:
+        for element in line.elements:
+            if isinstance(element, Station):
+                bounds = element.get_label_bounds(map_data.font_path)
+                if bounds is not None:
+                    svg.add_text(element.name, bounds, background=LABEL_BACKGROUND)
+
+
+def draw_lines_info(svg, map_data):
+    left, top, _, _ = map_data.get_lines_info_bounds()
+    cur_top = top
+    for line in map_data.lines:
+        path = os.path.join(map_data.assets_path, "images", line.line_json["logo_filename"])
+        svg.add_image(
+            path, get_place_bounds(line.get_logo_size(), (left + 30, cur_top + 20), RelativeTo.CENTER)
+        )
+        line_width = line.line_image.height
+        svg.add(
+            "rect",
+            x=left + 70,
+            y=cur_top + 20 - line_width // 2,
+            width=100,
+            height=line_width,
+            fill=get_color(line.line_image),
+        )
+        svg.add_text(
+            line.name,
+            get_place_bounds(
+                get_text_size(line.name, map_data.font_path),
+                (left + 190, cur_top + 20),
+                RelativeTo.LEFT,
+            ),
+            background=LABEL_BACKGROUND,
+        )
+        cur_top += 33
+
+
+def write_svg_map(map_data, filename):
+    svg = SvgWriter(map_data.image_resolution[1], map_data.image_resolution[0], map_data.font_path)
+
+    for line in sorted(map_data.lines, key=cmp_to_key(Line.cmp)):
+        draw_line_path(svg, line)
+    for line in map_data.lines:
+        draw_logos(svg, line)
+    draw_transfers(svg, map_data)
+    draw_labels(svg, map_data)
+    draw_lines_info(svg, map_data)
+    svg.add_image(
+        os.path.join(map_data.assets_path, "images", map_data.map_data_json["info_filename"]),
+        map_data.get_info_bounds(),
+    )
+
+    with open(filename, "w", encoding="utf-8") as file:
+        svg.write(file)
+    return len(svg.elements)
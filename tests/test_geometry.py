@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("wand.image", exc_type=ImportError)
+
+from wand.color import Color  # noqa: E402
+from wand.image import Image  # noqa: E402
+
+from draw_elements import (  # noqa: E402
+    Orientation,
+    get_end_station,
+    get_station,
+    get_transfer,
+)
+from utilities import ImageSize, get_image_size  # noqa: E402
+
+LINE_HEIGHTS = [5, 8, 9, 12, 15]
+
+
+@pytest.fixture(params=LINE_HEIGHTS)
+def line(request):
+    with Image(width=1, height=request.param, background=Color("#0078BE")) as line:
+        yield line
+
+
+@pytest.mark.parametrize("orientation", [o for o in Orientation if o.value < 360])
+def test_station_sizes(line, orientation):
+    size = ImageSize(line.width, line.height)
+    assert get_station(size, orientation) == get_image_size(get_station(line, orientation))
+    assert get_end_station(size, orientation) == get_image_size(get_end_station(line, orientation))
+
+
+@pytest.mark.parametrize("line_type", ["metro", "mcd"])
+@pytest.mark.parametrize("orientation", list(Orientation))
+def test_transfer_size(line, line_type, orientation):
+    assert get_transfer(ImageSize(line.width, line.height), line_type, orientation) == get_image_size(
+        get_transfer(line, line_type, orientation)
+    )
+
+
+def test_geometry_matches_display_list(tmp_path):
+    from benchmarks.synthetic import find_font, load_map_data, write_network
+
+    font_path = find_font()
+    if font_path is None:
+        pytest.skip("no TrueType font found")
+    map_data = load_map_data(*write_network(str(tmp_path), 3, 25, font_path, transfer_every=5))
+    assert map_data.get_geometry().entries == map_data.get_display_list().geometry.entries
@@ -0,0 +1,91 @@
+import numpy
+import pytest
+
+pytest.importorskip("wand.image", exc_type=ImportError)
+
+from wand.color import Color  # noqa: E402
+from wand.image import Image  # noqa: E402
+
+from draw_elements import get_line_color, get_line_strip  # noqa: E402
+from raster_backend import get_pixel_difference  # noqa: E402
+from utilities import Shape, ShapeBatch, draw_shapes  # noqa: E402
+
+
+def get_line_image(column, width=1):
+    pixels = numpy.empty((len(column), width, 4), dtype=numpy.uint8)
+    pixels[:] = numpy.array(column, dtype=numpy.uint8)[:, numpy.newaxis]
+    return Image.from_array(pixels, channel_map="RGBA")
+
+
+def get_resized_strip(line, length, vertical):
+    strip = line.clone()
+    strip.resize(length, line.height)
+    if vertical:
+        strip.rotate(90)
+    return strip
+
+
+@pytest.mark.parametrize("width", [1, 3])
+@pytest.mark.parametrize("alpha", [255, 128])
+@pytest.mark.parametrize("vertical", [False, True])
+@pytest.mark.parametrize("length", [1, 7, 250])
+def test_strip_of_one_colour(width, alpha, vertical, length):
+    with get_line_image([[0, 120, 190, alpha]] * 9, width) as line:
+        with get_line_strip(line, length, vertical) as strip, get_resized_strip(
+                line, length, vertical
+        ) as expected:
+            assert get_pixel_difference(strip, expected)[0] == 0
+
+
+@pytest.mark.parametrize("vertical", [False, True])
+def test_patterned_strip(vertical):
+    column = [[214, 8, 59, 255]] * 3 + [[255, 255, 255, 255]] * 3 + [[214, 8, 59, 255]] * 3
+    with get_line_image(column) as line:
+        with get_line_strip(line, 40, vertical) as strip, get_resized_strip(
+                line, 40, vertical
+        ) as expected:
+            assert get_pixel_difference(strip, expected)[0] == 0
+
+
+def test_line_color():
+    with get_line_image([[0, 154, 73, 255]] * 9) as line:
+        assert get_line_color(line) == Color("#009A49")
+    with get_line_image([[0, 154, 73, 128]] * 9) as line:
+        assert get_line_color(line) is None
+    with get_line_image([[0, 154, 73, 255]] * 4 + [[255, 255, 255, 255]] * 5) as line:
+        assert get_line_color(line) is None
+
+
+@pytest.mark.parametrize("vertical", [False, True])
+def test_rectangle_matches_strip(vertical):
+    with get_line_image([[148, 62, 144, 255]] * 9) as line:
+        with get_line_strip(line, 30, vertical) as strip:
+            with Image(width=60, height=60, background=Color("white")) as expected:
+                expected.composite(strip, left=11, top=13)
+                with Image(width=60, height=60, background=Color("white")) as image:
+                    draw_shapes(
+                        image,
+                        [
+                            Shape(
+                                "rectangle",
+                                get_line_color(line),
+                                None,
+                                ((11, 13), (11 + strip.width - 1, 13 + strip.height - 1)),
+                            )
+                        ],
+                    )
+                    assert get_pixel_difference(image, expected)[0] == 0
+
+
+def test_batch_keeps_drawing_order():
+    rectangle = Shape("rectangle", Color("#D6083B"), None, ((0, 10), (39, 18)))
+    with Image(width=10, height=10, background=Color("#0078BE")) as glyph:
+        with Image(width=60, height=40, background=Color("white")) as expected:
+            draw_shapes(expected, [rectangle])
+            expected.composite(glyph, left=30, top=12)
+            with Image(width=60, height=40, background=Color("white")) as image:
+                batch = ShapeBatch(image)
+                batch.add_shape(rectangle)
+                batch.composite(glyph, left=30, top=12)
+                batch.flush()
+                assert get_pixel_difference(image, expected)[0] == 0
@@ -0,0 +1,117 @@
+import numpy
+import pytest
+
+pytest.importorskip("wand.image", exc_type=ImportError)
+
+from wand.color import Color  # noqa: E402
+from wand.image import Image  # noqa: E402
+
+from raster_backend import NumpyCanvas, WandCanvas, get_pixel_difference  # noqa: E402
+from utilities import Shape  # noqa: E402
+
+# one step of an 8-bit channel
+MAX_DIFFERENCE = 1 / 255
+
+
+def get_source(width, height, color, alpha):
+    pixels = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    pixels[:] = color + [alpha]
+    return Image.from_array(pixels, channel_map="RGBA")
+
+
+def get_gradient_source(width, height):
+    # every pixel has a different color and alpha
+    pixels = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    pixels[..., 0] = numpy.linspace(0, 255, width, dtype=numpy.uint8)
+    pixels[..., 1] = numpy.linspace(255, 0, height, dtype=numpy.uint8)[:, None]
+    pixels[..., 2] = 128
+    pixels[..., 3] = numpy.linspace(0, 255, width * height, dtype=numpy.uint8).reshape(
+        height, width
+    )
+    return Image.from_array(pixels, channel_map="RGBA")
+
+
+def draw_both(draw, width=64, height=48, background=Color("white")):
+    canvases = [
+        canvas_class(width, height, background) for canvas_class in [WandCanvas, NumpyCanvas]
+    ]
+    for canvas in canvases:
+        draw(canvas)
+    with canvases[0].get_image() as wand_image, canvases[1].get_image() as numpy_image:
+        return get_pixel_difference(wand_image, numpy_image)
+
+
+def test_opaque_composites():
+    with get_source(20, 10, [214, 8, 59], 255) as red, get_source(8, 30, [0, 120, 190], 255) as blue:
+        def draw(canvas):
+            canvas.composite(red, left=5, top=5)
+            canvas.composite(blue, left=15, top=2)
+            canvas.composite(red, left=30, top=20)
+
+        max_difference, _ = draw_both(draw)
+    assert max_difference <= MAX_DIFFERENCE
+
+
+def test_alpha_sources():
+    with get_gradient_source(40, 30) as gradient, get_source(30, 30, [0, 154, 73], 96) as green:
+        def draw(canvas):
+            canvas.composite(green, left=0, top=0)
+            canvas.composite(gradient, left=10, top=8)
+            canvas.composite(green, left=20, top=15)
+
+        max_difference, _ = draw_both(draw)
+    assert max_difference <= MAX_DIFFERENCE
+
+
+def test_alpha_sources_on_transparent_canvas():
+    with get_gradient_source(40, 30) as gradient, get_source(30, 30, [0, 154, 73], 96) as green:
+        def draw(canvas):
+            canvas.composite(green, left=4, top=4)
+            canvas.composite(gradient, left=12, top=10)
+
+        max_difference, _ = draw_both(draw, background=Color("transparent"))
+    assert max_difference <= MAX_DIFFERENCE
+
+
+def test_shapes():
+    shapes = [
+        Shape("line", Color("#0078BE"), 3, ((4, 4), (60, 40))),
+        Shape("line", Color("#D6083B"), None, ((4, 40), (60, 4))),
+        Shape("circle", Color("#943E90"), None, ((32, 24), (32, 14))),
+    ]
+    with get_source(20, 20, [255, 205, 28], 255) as yellow:
+        def draw(canvas):
+            canvas.composite(yellow, left=22, top=14)
+            canvas.draw_shapes(shapes)
+
+        max_difference, _ = draw_both(draw)
+    assert max_difference <= MAX_DIFFERENCE
+
+
+def test_shapes_with_origin():
+    shapes = [Shape("line", Color("#009A49"), 2, ((104, 210), (150, 240)))]
+    max_difference, _ = draw_both(lambda canvas: canvas.draw_shapes(shapes, (100, 200)))
+    assert max_difference <= MAX_DIFFERENCE
+
+
+@pytest.mark.parametrize(
+    "left, top",
+    [(-10, -5), (50, 40), (-30, 20), (10, -25), (64, 0), (0, 48), (-40, -40), (100, 100)],
+)
+def test_off_canvas_placement(left, top):
+    with get_gradient_source(40, 30) as gradient:
+        max_difference, _ = draw_both(lambda canvas: canvas.composite(gradient, left=left, top=top))
+    assert max_difference <= MAX_DIFFERENCE
+
+
+def test_synthetic_map(tmp_path):
+    from benchmarks.synthetic import find_font, load_map_data, write_network
+    from raster_backend import draw_map
+
+    font_path = find_font()
+    if font_path is None:
+        pytest.skip("no TrueType font found")
+    map_data = load_map_data(*write_network(str(tmp_path), 3, 12, font_path, textured=True))
+    with draw_map(map_data, "wand") as wand_image, draw_map(map_data, "numpy") as numpy_image:
+        max_difference, _ = get_pixel_difference(wand_image, numpy_image)
+    assert max_difference <= MAX_DIFFERENCE
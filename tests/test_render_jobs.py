@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+pytest.importorskip("wand.image", exc_type=ImportError)
+
+from benchmarks.synthetic import find_font, run_main, write_network  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def network(tmp_path_factory):
+    font_path = find_font()
+    if font_path is None:
+        pytest.skip("no TrueType font found")
+    return write_network(str(tmp_path_factory.mktemp("network")), 3, 12, font_path, transfer_every=4)
+
+
+def render(tmp_path, network, jobs, *args):
+    output = os.path.join(str(tmp_path), f"jobs_{jobs}")
+    run_main(*args[:1], *network, *args[1:], "--force", "--jobs", str(jobs), "-o", output)
+    files = {}
+    for filename in sorted(os.listdir(output)):
+        with open(os.path.join(output, filename), "rb") as file:
+            files[filename] = file.read()
+    return files
+
+
+@pytest.mark.parametrize(
+    "args",
+    [("linear", "--all"), ("station", "--all_lines", "--all_stations")],
+    ids=["linear", "station"],
+)
+def test_parallel_matches_serial(tmp_path, network, args):
+    serial = render(tmp_path, network, 1, *args)
+    parallel = render(tmp_path, network, 2, *args)
+    assert serial
+    assert list(parallel) == list(serial)
+    for filename, data in serial.items():
+        assert parallel[filename] == data, filename
@@ -0,0 +1,217 @@
+import logging
+import os
+import struct
+import time
+import zlib
+
+from wand.color import Color
+from wand.image import Image
+
+from image_writer import create_writer, output_stats, writer_options
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COLOR_TYPES = {"RGB": 2, "RGBA": 6}
+
+
+class PngWriter:
+    def __init__(self, file, width, height, channel_map="RGB", compression_level=6):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.row_size = width * len(channel_map)
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compression_level)
+
+        self.file.write(PNG_SIGNATURE)
+        self.write_chunk(
+            b"IHDR",
+            struct.pack(
+                ">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[channel_map], 0, 0, 0
+            ),
+        )
+
+    def write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+    def write_rows(self, pixels):
+        for offset in range(0, len(pixels), self.row_size):
+            compressed = self.compressor.compress(
+                b"\x00" + pixels[offset: offset + self.row_size]
+            )
+            if compressed:
+                self.write_chunk(b"IDAT", compressed)
+            self.rows_written += 1
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise Exception(f"Expected {self.height} rows, got {self.rows_written}")
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+
+
+def get_tiles_bounds(width, height, tile_size):
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield left, top, min(tile_size, width - left), min(tile_size, height - top)
+
+
+def render_tile(display_list, bounds, background=Color("white")):
+    tile = Image(width=bounds[2], height=bounds[3], background=background)
+    operations_count = display_list.replay(tile, bounds[:2])
+    return tile, operations_count
+
+
+def get_pixels(image, channel_map="RGB"):
+    image.depth = 8
+    return image.make_blob(channel_map)
+
+
+def write_tiled_png(map_data, filename, tile_size, highlighted_station=None):
+    display_list = map_data.get_display_list(highlighted_station, tile_size)
+    width, height = display_list.size
+    logging.info(
+        f"Recorded {len(display_list.operations)} operations for a {width}x{height} map"
+    )
+
+    with open(filename, "wb") as file:
+        compression_level = writer_options["compression_level"]
+        if compression_level is None:
+            compression_level = 6
+        writer = PngWriter(file, width, height, compression_level=compression_level)
+        # PNG rows span the whole width, so one row of tiles is kept as raw
+        # 8-bit pixels until all of its tiles are rendered
+        for top in range(0, height, tile_size):
+            band_height = min(tile_size, height - top)
+            band = []
+            for left in range(0, width, tile_size):
+                tile_width = min(tile_size, width - left)
+                bounds = (left, top, tile_width, band_height)
+                if not display_list.get_operations(bounds):
+                    # nothing is drawn here, the tile is the white background
+                    band.append((b"\xff" * (tile_width * band_height * 3), tile_width * 3))
+                    continue
+                tile, operations_count = render_tile(display_list, bounds)
+                with tile:
+                    band.append((get_pixels(tile), tile_width * 3))
+                logging.debug(
+                    f"Rendered tile ({left}, {top}) with {operations_count} operations"
+                )
+
+            for y in range(band_height):
+                writer.write_rows(
+                    b"".join(
+                        pixels[y * row_size: (y + 1) * row_size]
+                        for pixels, row_size in band
+                    )
+                )
+        writer.close()
+
+
+class TilePyramid:
+    def __init__(self, display_list, output, tile_size, writer):
+        self.display_list = display_list
+        self.output = output
+        self.tile_size = tile_size
+        self.writer = writer
+        self.tiles_written = 0
+        self.tiles_skipped = 0
+
+        self.width, self.height = display_list.size
+        self.max_level = max(self.width, self.height).bit_length()
+        if max(self.width, self.height) == 1 << (self.max_level - 1):
+            self.max_level -= 1
+
+    def get_level_size(self, level):
+        scale = 1 << (self.max_level - level)
+        return -(-self.width // scale), -(-self.height // scale)
+
+    def get_tile_bounds(self, level, col, row):
+        level_width, level_height = self.get_level_size(level)
+        left = col * self.tile_size
+        top = row * self.tile_size
+        return (
+            left,
+            top,
+            min(self.tile_size, level_width - left),
+            min(self.tile_size, level_height - top),
+        )
+
+    def get_tile_filename(self, level, col, row):
+        return os.path.join(self.output + "_files", str(level), f"{col}_{row}.png")
+
+    def build_tile(self, level, col, row):
+        bounds = self.get_tile_bounds(level, col, row)
+        if bounds[2] <= 0 or bounds[3] <= 0:
+            return None
+
+        if level == self.max_level:
+            if not self.display_list.get_operations(bounds):
+                self.tiles_skipped += 1
+                return None
+            tile, _ = render_tile(self.display_list, bounds)
+        else:
+            children = {}
+            for dx in [0, 1]:
+                for dy in [0, 1]:
+                    child = self.build_tile(level + 1, 2 * col + dx, 2 * row + dy)
+                    if child is not None:
+                        children[dx, dy] = child
+            if not children:
+                self.tiles_skipped += 1
+                return None
+
+            # the tile is made from the four tiles below it, parts without
+            # content are the plain map background
+            child_width, child_height = self.get_level_size(level + 1)
+            tile = Image(
+                width=min(2 * self.tile_size, child_width - 2 * bounds[0]),
+                height=min(2 * self.tile_size, child_height - 2 * bounds[1]),
+                background=Color("white"),
+            )
+            for (dx, dy), child in children.items():
+                tile.composite(child, left=dx * self.tile_size, top=dy * self.tile_size)
+                child.close()
+            tile.resize(bounds[2], bounds[3], filter="box")
+
+        self.write_tile(tile.clone(), self.get_tile_filename(level, col, row))
+        return tile
+
+    def write_tile(self, tile, filename):
+        self.writer.submit(tile, [filename])
+        self.tiles_written += 1
+
+    def build(self):
+        for level in range(self.max_level + 1):
+            os.makedirs(os.path.join(self.output + "_files", str(level)), exist_ok=True)
+
+        tile = self.build_tile(0, 0, 0)
+        if tile is not None:
+            tile.close()
+
+    def write_descriptor(self):
+        with open(self.output + ".dzi", "w", encoding="utf-8") as file:
+            file.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+                f'Format="png" Overlap="0" TileSize="{self.tile_size}">\n'
+                f'  <Size Width="{self.width}" Height="{self.height}"/>\n'
+                "</Image>\n"
+            )
+
+
+def export_tiles(map_data, output, tile_size, jobs_count, highlighted_station=None):
+    start_time = time.perf_counter()
+    display_list = map_data.get_display_list(highlighted_station, tile_size)
+    writer = create_writer(threads=jobs_count, max_pending=4 * jobs_count)
+    pyramid = TilePyramid(display_list, output, tile_size, writer)
+    pyramid.build()
+    # everything the build thread did apart from waiting for the writer
+    render_time = time.perf_counter() - start_time - writer.stats.wait_time
+    output_stats.render_time += render_time
+    output_stats.add(writer.close())
+    # the descriptor is written last so a viewer never sees missing tiles
+    pyramid.write_descriptor()
+    return pyramid
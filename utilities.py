@@ -1,10 +1,44 @@
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from enum import Enum
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+import numpy
 
 from wand.color import Color
 from wand.drawing import Drawing
 from wand.image import Image
 
+from raster_cache import get_cached_raster
+
+
+_file_hashes = {}
+
+
+def get_file_hash(path):
+    path = os.path.abspath(path)
+    file_hash = _file_hashes.get(path)
+    if file_hash is None:
+        with open(path, "rb") as file:
+            file_hash = _file_hashes[path] = hashlib.sha256(file.read()).hexdigest()
+    return file_hash
+
+
+_images = {}
+
+
+def load_image(path):
+    # assets are shared between lines and decoded on first use, callers
+    # must clone an image before changing it
+    path = os.path.abspath(path)
+    image = _images.get(path)
+    if image is None:
+        image = _images[path] = Image(filename=path)
+    return image
+
 
 class RelativeTo(Enum):
     TOP_LEFT = 0
@@ -23,25 +57,273 @@ class Direction(Enum):
     DOWN = 3
 
 
-def place(image, image_to_place, coords, relative_to):
+class Shape(NamedTuple):
+    kind: str
+    color: Color
+    stroke_width: Optional[float]
+    points: Tuple[Tuple[float, float], ...]
+
+    def get_bounds(self):
+        if self.kind == "rectangle":
+            # the corners are the first and the last pixel of the fill
+            (left, top), (right, bottom) = self.points
+            return left, top, right - left + 1, bottom - top + 1
+        if self.kind == "circle":
+            center, perimeter = self.points
+            radius = ((perimeter[0] - center[0]) ** 2 + (perimeter[1] - center[1]) ** 2) ** 0.5
+            points = ((center[0] - radius, center[1] - radius), (center[0] + radius, center[1] + radius))
+        else:
+            points = self.points
+        margin = (self.stroke_width or 1) / 2 + 1
+        left = int(min(point[0] for point in points) - margin)
+        top = int(min(point[1] for point in points) - margin)
+        right = int(max(point[0] for point in points) + margin) + 1
+        bottom = int(max(point[1] for point in points) + margin) + 1
+        return left, top, right - left, bottom - top
+
+
+def draw_shapes(image, shapes, origin=(0, 0)):
+    if isinstance(image, DisplayList):
+        for shape in shapes:
+            image.add_shape(shape)
+        return
+    if not isinstance(image, Image):
+        # raster backend canvases draw shapes their own way
+        image.draw_shapes(shapes, origin)
+        return
+    if not shapes:
+        return
+
+    # every shape goes into one drawing pass over the image, the style is
+    # switched between shapes so they are drawn in their original order
+    with Drawing() as draw:
+        if origin != (0, 0):
+            draw.translate(-origin[0], -origin[1])
+        default_fill_color = draw.fill_color
+        default_stroke_width = draw.stroke_width
+        for shape in shapes:
+            draw.stroke_color = shape.color
+            draw.stroke_width = (
+                shape.stroke_width if shape.stroke_width is not None else default_stroke_width
+            )
+            draw.stroke_antialias = shape.kind != "rectangle"
+            if shape.kind == "rectangle":
+                # filled without a stroke or antialiasing, so it covers its
+                # pixels exactly like a composited image of one colour
+                draw.stroke_color = Color("none")
+                draw.fill_color = shape.color
+                draw.rectangle(*shape.points[0], *shape.points[1])
+            elif shape.kind == "circle":
+                draw.fill_color = shape.color
+                draw.circle(*shape.points)
+            else:
+                draw.fill_color = default_fill_color
+                draw.line(*shape.points)
+        draw(image)
+
+
+def intersects(bounds1, bounds2):
+    return (
+            bounds1[0] < bounds2[0] + bounds2[2]
+            and bounds2[0] < bounds1[0] + bounds1[2]
+            and bounds1[1] < bounds2[1] + bounds2[3]
+            and bounds2[1] < bounds1[1] + bounds1[3]
+    )
+
+
+def get_union(bounds1, bounds2):
+    left = min(bounds1[0], bounds2[0])
+    top = min(bounds1[1], bounds2[1])
+    right = max(bounds1[0] + bounds1[2], bounds2[0] + bounds2[2])
+    bottom = max(bounds1[1] + bounds1[3], bounds2[1] + bounds2[3])
+    return left, top, right - left, bottom - top
+
+
+class GridIndex:
+    # Spatial index over (bounds, item) pairs: every entry is listed in the
+    # grid cells it touches, queries return entries in insertion order
+    def __init__(self, cell_size=512):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_cells(self, bounds):
+        left, top, width, height = bounds
+        for col in range(left // self.cell_size, (left + width - 1) // self.cell_size + 1):
+            for row in range(top // self.cell_size, (top + height - 1) // self.cell_size + 1):
+                yield col, row
+
+    def insert(self, bounds, item):
+        num = len(self.entries)
+        self.entries.append((bounds, item))
+        for cell in self.get_cells(bounds):
+            self.cells.setdefault(cell, []).append(num)
+        return num
+
+    def query(self, bounds):
+        indices = set()
+        for cell in self.get_cells(bounds):
+            indices.update(self.cells.get(cell, ()))
+        return [
+            self.entries[num]
+            for num in sorted(indices)
+            if intersects(self.entries[num][0], bounds)
+        ]
+
+
+class ItemKind(Enum):
+    SEGMENT = "segment"
+    ARC = "arc"
+    STATION = "station"
+    LABEL = "label"
+    LOGO = "logo"
+    TRANSFER = "transfer"
+    INFO = "info"
+
+
+class MapItem(NamedTuple):
+    kind: ItemKind
+    name: str
+    owner: Optional[str]
+
+
+class ImageSize(NamedTuple):
+    # stands in for an image wherever only its size matters
+    width: int
+    height: int
+
+
+def get_image_size(image):
+    return None if image is None else ImageSize(image.width, image.height)
+
+
+class DisplayList:
+    # Stands in for a canvas of the given size: composites and shapes are
+    # recorded with their bounds and can later be replayed onto any window
+    # of the canvas. Every operation is also entered into the geometry index
+    # under the map item that drew it. A measuring display list only builds
+    # the geometry, its drawing code passes sizes instead of images.
+    def __init__(self, width, height, cell_size=512, measure_only=False):
+        self.width = width
+        self.height = height
+        self.measure_only = measure_only
+        self.index = GridIndex(cell_size)
+        self.operations = self.index.entries
+        self.geometry = GridIndex(cell_size)
+        self.owner = None
+        self.item = None
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def add_operation(self, bounds, operation):
+        if not self.measure_only:
+            self.index.insert(bounds, operation)
+        if self.item is not None:
+            self.geometry.insert(bounds, self.item._replace(owner=self.owner))
+
+    def composite(self, image, left=None, top=None, *args, **kwargs):
+        self.add_operation(
+            (left or 0, top or 0, image.width, image.height),
+            (image, left or 0, top or 0),
+        )
+
+    def add_shape(self, shape):
+        self.add_operation(shape.get_bounds(), shape)
+
+    def get_operations(self, bounds):
+        return self.index.query(bounds)
+
+    def replay(self, image, origin=(0, 0)):
+        operations = self.get_operations((origin[0], origin[1], image.width, image.height))
+        shapes = []
+        for bounds, operation in operations:
+            if isinstance(operation, Shape):
+                shapes.append(operation)
+                continue
+            draw_shapes(image, shapes, origin)
+            shapes = []
+            image_to_place, left, top = operation
+            image.composite(image_to_place, left=left - origin[0], top=top - origin[1])
+        draw_shapes(image, shapes, origin)
+        return len(operations)
+
+
+class ShapeBatch:
+    # Stands in for an image while shapes are collected for one drawing
+    # pass. Composites go straight to the image, the collected shapes are
+    # drawn first when a composite overlaps them so the drawing order holds
+    def __init__(self, image, cell_size=256):
+        self.image = image
+        self.cell_size = cell_size
+        self.index = GridIndex(cell_size)
+
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+    def add_shape(self, shape):
+        self.index.insert(shape.get_bounds(), shape)
+
+    def composite(self, image, left=0, top=0):
+        if self.index.query((left, top, image.width, image.height)):
+            self.flush()
+        self.image.composite(image, left=left, top=top)
+
+    def flush(self):
+        draw_shapes(self.image, [shape for _, shape in self.index.entries])
+        self.index = GridIndex(self.cell_size)
+
+
+def is_measuring(image):
+    return isinstance(image, DisplayList) and image.measure_only
+
+
+def set_owner(image, owner):
+    # only display lists keep track of which map element drew what
+    if isinstance(image, DisplayList):
+        image.owner = owner
+
+
+def set_item(image, kind, name):
+    if isinstance(image, DisplayList):
+        image.item = MapItem(kind, name, None) if kind is not None else None
+
+
+def get_place_bounds(size, coords, relative_to):
+    width, height = size
     coords = list(coords)
-    half_size = (image_to_place.width // 2, image_to_place.height // 2)
+    half_size = (width // 2, height // 2)
     if relative_to == RelativeTo.LEFT_DOWN:
-        coords[1] -= image_to_place.height - 1
+        coords[1] -= height - 1
     if relative_to in [RelativeTo.LEFT, RelativeTo.RIGHT]:
         coords[1] -= half_size[1]
         if relative_to == RelativeTo.RIGHT:
-            coords[0] -= image_to_place.width - 1
+            coords[0] -= width - 1
     if relative_to in [RelativeTo.UP, RelativeTo.DOWN]:
         coords[0] -= half_size[0]
         if relative_to == RelativeTo.DOWN or relative_to == RelativeTo.LEFT_DOWN:
-            coords[1] -= image_to_place.height - 1
+            coords[1] -= height - 1
     if relative_to == RelativeTo.CENTER:
         coords[0] -= half_size[0]
         coords[1] -= half_size[1]
+    return coords[0], coords[1], width, height
 
-    image.composite(image_to_place, left=coords[0], top=coords[1])
-    return [coords[0] + half_size[0], coords[1] + half_size[1]]
+
+def place(image, image_to_place, coords, relative_to):
+    left, top, width, height = get_place_bounds(
+        (image_to_place.width, image_to_place.height), coords, relative_to
+    )
+    image.composite(image_to_place, left=left, top=top)
+    return [left + width // 2, top + height // 2]
 
 
 def turn(direction, clockwise):
@@ -80,34 +362,92 @@ def move_by_image(coords, image, direction):
         return move(coords, image.height, Direction[direction.upper()])
 
 
+_metrics_context = threading.local()
+
+
+@lru_cache(maxsize=4096)
+def get_font_metrics(text, font_path, font_size):
+    image = getattr(_metrics_context, "image", None)
+    if image is None:
+        image = _metrics_context.image = Image(width=1, height=1)
+
+    with Drawing() as draw:
+        draw.font = font_path
+        draw.font_size = font_size
+        metrics = draw.get_font_metrics(image, text, multiline=True)
+    return metrics.text_width, metrics.text_height
+
+
+def get_text_padding(font_color):
+    if font_color == Color("black"):
+        return 0, 0
+    return 5, 3
+
+
+def get_text_size(text, font_path, font_color=Color("black"), font_size=18):
+    text_width, text_height = get_font_metrics(text, font_path, font_size)
+    padding_size = get_text_padding(font_color)
+    return (
+        int(text_width + 2 * padding_size[0]),
+        int(text_height + 2 * padding_size[1]),
+    )
+
+
+_text_images = OrderedDict()
+_text_images_lock = threading.Lock()
+TEXT_IMAGES_CACHE_SIZE = 4096
+
+
 def get_text_image(
         text,
-        image,
         font_path,
         font_color=Color("black"),
         background_color=Color("#FFFFFF80"),
         font_size=18
 ):
-    padding_size = (5, 3)
+    # the returned image is shared between callers and must not be modified
+    key = (text, font_path, font_color.string, background_color.string, font_size)
+    with _text_images_lock:
+        text_image = _text_images.get(key)
+        if text_image is not None:
+            _text_images.move_to_end(key)
+            return text_image
+
+    text_image = get_cached_raster(
+        ("text", text, get_file_hash(font_path), *key[2:]),
+        lambda: render_text_image(
+            text, font_path, font_color, background_color, font_size
+        ),
+    )
+    text_image.virtual_pixel = "transparent"
 
-    if font_color == Color("black"):
-        padding_size = (0, 0)
+    with _text_images_lock:
+        _text_images[key] = text_image
+        while len(_text_images) > TEXT_IMAGES_CACHE_SIZE:
+            _text_images.popitem(last=False)
+    return text_image
+
+
+def clear_asset_caches():
+    # asset files are only read once per process, a reload of the map
+    # starts from scratch so edited images and fonts are picked up
+    _file_hashes.clear()
+    _images.clear()
+    with _text_images_lock:
+        _text_images.clear()
+    get_font_metrics.cache_clear()
+
+
+def render_text_image(text, font_path, font_color, background_color, font_size):
+    padding_size = get_text_padding(font_color)
+
+    width, height = get_text_size(text, font_path, font_color, font_size)
 
     draw = Drawing()
     draw.fill_color = font_color
     draw.font = font_path
     draw.font_size = font_size
-    res_image = Image(
-        width=int(
-            draw.get_font_metrics(image, text, multiline=True).text_width
-            + 2 * padding_size[0]
-        ),
-        height=int(
-            draw.get_font_metrics(image, text, multiline=True).text_height
-            + 2 * padding_size[1]
-        ),
-        background=background_color,
-    )
+    res_image = Image(width=width, height=height, background=background_color)
     res_image.virtual_pixel = "transparent"
     draw.text(padding_size[0], font_size - 4 + padding_size[1], text)
     draw(res_image)
@@ -130,13 +470,18 @@ def get_arrow_image(size, color=Color("black"), background=Color("white")):
     return image
 
 
+def get_direction_image_width(logo_image, last_station_name, font_path):
+    return (
+            20 + 27 + 10 + logo_image.width + 10
+            + get_text_size(last_station_name, font_path)[0] + 20
+    )
+
+
 def get_direction_image(
         logo_image, last_station_name, font_path, reverse_direction=False
 ):
-    last_station_name_image = get_text_image(last_station_name, logo_image, font_path)
-    image_width = (
-            20 + 27 + 10 + logo_image.width + 10 + last_station_name_image.width + 20
-    )
+    last_station_name_image = get_text_image(last_station_name, font_path)
+    image_width = get_direction_image_width(logo_image, last_station_name, font_path)
 
     direction_image = Image(width=image_width, height=128, background=Color("white"))
 
@@ -169,19 +514,31 @@ def get_direction_image(
     return direction_image
 
 
+@lru_cache(maxsize=None)
+def get_corner_mask(radius):
+    offsets = numpy.arange(radius + 1)
+    return offsets[numpy.newaxis, :] ** 2 + offsets[:, numpy.newaxis] ** 2 > radius ** 2
+
+
 def round_corner(image, radius, coords, positive_dx, positive_dy):
-    for x in (
-            range(coords[0], coords[0] + radius + 1)
-            if positive_dx
-            else range(coords[0] - radius, coords[0] + 1)
-    ):
-        for y in (
-                range(coords[1], coords[1] + radius + 1)
-                if positive_dy
-                else range(coords[1] - radius, coords[1] + 1)
-        ):
-            if (x - coords[0]) ** 2 + (y - coords[1]) ** 2 > radius ** 2:
-                image[x, y] = Color("#FFFFFF00")
+    mask = get_corner_mask(radius)
+    if not positive_dx:
+        mask = mask[:, ::-1]
+    if not positive_dy:
+        mask = mask[::-1, :]
+
+    left = coords[0] if positive_dx else coords[0] - radius
+    top = coords[1] if positive_dy else coords[1] - radius
+
+    # same channels as a Color("#FFFFFF00") pixel assignment would write
+    channel_map = "RGBA" if image.alpha_channel else "RGB"
+    pixels = numpy.array(
+        image.export_pixels(left, top, radius + 1, radius + 1, channel_map, "double")
+    ).reshape(radius + 1, radius + 1, len(channel_map))
+    pixels[mask] = (1.0, 1.0, 1.0, 0.0)[: len(channel_map)]
+    image.import_pixels(
+        left, top, radius + 1, radius + 1, channel_map, "double", pixels.ravel().tolist()
+    )
 
 
 def round_corners(image, radius):
@@ -193,6 +550,19 @@ def round_corners(image, radius):
     )
 
 
+PNG_FILTERS = {"none": 0, "sub": 1, "up": 2, "average": 3, "paeth": 4, "adaptive": 5}
+
+
+def get_image_blob(image, image_format="png", compression_level=None, png_filter=None):
+    # timestamp chunks would make identical renders differ byte-wise
+    image.options["png:exclude-chunk"] = "date,time"
+    if compression_level is not None:
+        image.options["png:compression-level"] = str(compression_level)
+    if png_filter is not None:
+        image.options["png:compression-filter"] = str(PNG_FILTERS[png_filter])
+    return image.make_blob(image_format)
+
+
 def complete_width(image):
     map_width = image.width
     total_width = (map_width + 128 - 1) // 128 * 128